@@ -0,0 +1,79 @@
+"""Shared helpers: importing main.py in a scratch directory, summarising timings and writing JSON reports."""
+import os
+import sys
+import json
+import platform
+import importlib
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_main(workdir, **env):
+    """Import main.py with its output directories under workdir.
+
+    main.py resolves its paths and reads its environment at import time, so
+    the overrides must be in place before the first import.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.update({key: str(value) for key, value in env.items()})
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module("main")
+
+
+def summarize(values):
+    """min/median/max (and p95/p99 for longer series) of a list of seconds."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return None
+    summary = {
+        "min": round(float(values.min()), 4),
+        "median": round(float(np.median(values)), 4),
+        "max": round(float(values.max()), 4),
+    }
+    if values.size >= 10:
+        summary["p95"] = round(float(np.percentile(values, 95)), 4)
+        summary["p99"] = round(float(np.percentile(values, 99)), 4)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    """Machine and library versions, so results from different runs can be compared fairly."""
+    versions = {}
+    for name in ("numpy", "rasterio", "numba", "scipy", "flask"):
+        try:
+            versions[name] = importlib.import_module(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": versions,
+    }
+
+
+def write_report(report, output=None):
+    """Print the report as JSON, and also write it to output when given."""
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
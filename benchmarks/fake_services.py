@@ -0,0 +1,112 @@
+"""Local stand-ins for Nominatim and OpenTopography, so benchmarks run offline and reproducibly."""
+import json
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+
+from benchmarks.terrain import ARC_SECOND, terrain_at
+
+# Geocoded points fall inside this box (west, south, east, north), away from its edges
+REGION = (90.1, 23.1, 90.9, 23.9)
+
+
+def geocode_point(address, region=REGION):
+    """Deterministic point for an address: the same text always lands on the same spot."""
+    digest = hashlib.sha1(address.strip().lower().encode()).digest()
+    fx = int.from_bytes(digest[:4], "big") / 2 ** 32
+    fy = int.from_bytes(digest[4:8], "big") / 2 ** 32
+    west, south, east, north = region
+    return south + fy * (north - south), west + fx * (east - west)
+
+
+def dem_geotiff(west, south, east, north):
+    """SRTMGL1-like int16 GeoTIFF bytes covering a bounding box."""
+    width = max(1, int(round((east - west) / ARC_SECOND)))
+    height = max(1, int(round((north - south) / ARC_SECOND)))
+    lon = west + (np.arange(width) + 0.5) * (east - west) / width
+    lat = north - (np.arange(height) + 0.5) * (north - south) / height
+    with MemoryFile() as memfile:
+        with memfile.open(driver="GTiff", height=height, width=width, count=1, dtype="int16",
+                          crs="EPSG:4326", nodata=-32768,
+                          transform=from_bounds(west, south, east, north, width, height)) as dst:
+            dst.write(terrain_at(lon, lat), 1)
+        return memfile.read()
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Answers Nominatim /search and OpenTopography /API/globaldem requests."""
+
+    latency_s = 0.0
+    calls = {"geocode": 0, "dem": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if url.path == "/search":
+            with self.lock:
+                self.calls["geocode"] += 1
+            lat, lon = geocode_point(query.get("q", ""))
+            body = json.dumps([{
+                "lat": f"{lat:.7f}", "lon": f"{lon:.7f}", "display_name": query.get("q", ""),
+                "boundingbox": [f"{lat - 0.01:.7f}", f"{lat + 0.01:.7f}", f"{lon - 0.01:.7f}", f"{lon + 0.01:.7f}"]
+            }]).encode()
+            self._send(body, "application/json")
+        elif url.path == "/API/globaldem":
+            with self.lock:
+                self.calls["dem"] += 1
+            bounds = [float(query[k]) for k in ("west", "south", "east", "north")]
+            self._send(dem_geotiff(*bounds), "image/tiff")
+        else:
+            self.send_error(404)
+
+
+def start_fake_services(host="127.0.0.1", port=0, latency_s=0.0):
+    """Serve both fake APIs from a background thread.
+
+    Returns (server, settings), where settings holds the environment variables
+    that point main.py at the fakes.
+    """
+    FakeServiceHandler.latency_s = latency_s
+    server = ThreadingHTTPServer((host, port), FakeServiceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = f"{host}:{server.server_address[1]}"
+    return server, {
+        "NOMINATIM_DOMAIN": address,
+        "NOMINATIM_SCHEME": "http",
+        "OPENTOPO_URL": f"http://{address}/API/globaldem",
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake geocoder and DEM services")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+    server, settings = start_fake_services(port=args.port, latency_s=args.latency)
+    for key, value in settings.items():
+        print(f"export {key}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,224 @@
+"""End-to-end load test of POST /process against the fake geocoder and DEM services.
+
+    python -m benchmarks.load --requests 20 --concurrency 4 --output load.json
+    python -m benchmarks.load --endpoint stream --requests 20 --concurrency 4
+
+The Flask app is served in-process by a threaded WSGI server, so the sampled
+peak RSS covers every concurrent pipeline run. With --endpoint stream the
+requests go to /process/stream; an "error" event counts as a failed request and
+the time to the first "stage" event is reported as well. The command exits
+non-zero when any request failed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.common import environment_info, import_main, summarize, write_report
+from benchmarks.fake_services import REGION, start_fake_services
+from benchmarks.terrain import synthetic_landcover, write_raster
+
+LANDCOVER_RES = 3 / 3600  # coarser than the DEM, like a real national tile set
+LANDCOVER_MARGIN_DEG = 0.2  # covers AOIs around points near the edge of REGION
+
+
+def write_region_landcover(landcover_dir):
+    """One landcover tile covering every point the fake geocoder can return."""
+    os.makedirs(landcover_dir, exist_ok=True)
+    west, south, east, north = REGION
+    west, south = west - LANDCOVER_MARGIN_DEG, south - LANDCOVER_MARGIN_DEG
+    east, north = east + LANDCOVER_MARGIN_DEG, north + LANDCOVER_MARGIN_DEG
+    shape = (round((north - south) / LANDCOVER_RES), round((east - west) / LANDCOVER_RES))
+    write_raster(os.path.join(landcover_dir, "landcover.tif"), synthetic_landcover(shape),
+                 west, north, res=LANDCOVER_RES)
+
+
+class RSSSampler:
+    """Peak resident set size, sampled from a background thread.
+
+    The VmHWM high-water mark cannot be used here because StageProfiler resets
+    it at the start of every stage.
+    """
+
+    def __init__(self, interval_s=0.05):
+        self.interval_s = interval_s
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        self.peak_bytes = max(self.peak_bytes, int(line.split()[1]) * 1024)
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def request_bodies(n, same_address, backend, radius_km, viz_formats):
+    """Request payloads; distinct addresses by default so no cache layer short-circuits the run."""
+    for i in range(n):
+        body = {
+            "address": "Benchmark site 0" if same_address else f"Benchmark site {i}",
+            "rainfall_intensity": 2.0,
+            "duration": 24,
+            "hydrology_backend": backend,
+        }
+        if viz_formats is not None:
+            body["viz_formats"] = viz_formats
+        if radius_km is not None:
+            body["radius_km"] = radius_km
+        yield body
+
+
+def send(url, body):
+    start = time.perf_counter()
+    try:
+        response = requests.post(url, json=body, timeout=3600)
+        payload = response.json()
+        status = response.status_code
+    except (requests.RequestException, ValueError) as e:
+        payload, status = {"message": str(e)}, None
+    return {"latency_s": time.perf_counter() - start, "status": status, "payload": payload}
+
+
+def send_stream(url, body):
+    """POST to /process/stream and read Server-Sent Events until "result" or "error"."""
+    start = time.perf_counter()
+    first_stage_s, status, payload = None, None, {"message": "stream ended without a result"}
+    try:
+        with requests.post(url, json=body, stream=True, timeout=3600) as response:
+            if response.status_code != 200:
+                return {"latency_s": time.perf_counter() - start, "status": response.status_code,
+                        "payload": response.json(), "first_stage_s": None}
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "stage" and first_stage_s is None:
+                        first_stage_s = time.perf_counter() - start
+                    elif event == "result":
+                        status, payload = 200, json.loads(line[len("data: "):])
+                    elif event == "error":
+                        status, payload = "error event", json.loads(line[len("data: "):])
+    except (requests.RequestException, ValueError) as e:
+        payload = {"message": str(e)}
+    return {"latency_s": time.perf_counter() - start, "status": status, "payload": payload,
+            "first_stage_s": first_stage_s}
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of POST /process with offline fake services")
+    parser.add_argument("--endpoint", choices=("process", "stream"), default="process",
+                        help="POST /process, or /process/stream read as Server-Sent Events")
+    parser.add_argument("--requests", type=int, default=20, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--backend", choices=("numpy", "whitebox"), default="numpy")
+    parser.add_argument("--radius-km", type=float, help="AOI half-width (server default when omitted)")
+    parser.add_argument("--viz-formats", nargs="*", choices=("html", "vtp", "gltf"),
+                        help="3D exports per request (server default when omitted, none when empty)")
+    parser.add_argument("--same-address", action="store_true",
+                        help="Repeat one address to measure the cache layers instead of cold runs")
+    parser.add_argument("--no-dem-cache", action="store_true",
+                        help="Download a DEM per request instead of cutting it from cached tiles")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds the fake services wait before every response")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    services, service_env = start_fake_services(latency_s=args.latency)
+    with tempfile.TemporaryDirectory(prefix="floodfactor-load-") as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        landcover_dir = os.path.join(workdir, "landcover")
+        write_region_landcover(landcover_dir)
+        main = import_main(
+            workdir, LANDCOVER_DIR=landcover_dir, DEM_CACHE_ENABLED="0" if args.no_dem_cache else "1",
+            **service_env
+        )
+        main.LANDCOVER_LEGACY_FILE = os.path.join(workdir, "merged_landcover.tif")  # never the repo's file
+        main._priority_flood(np.zeros((3, 3)), main.FILL_EPSILON)  # JIT-compile outside the timings
+
+        server = make_server("127.0.0.1", 0, main.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/process"
+        if args.endpoint == "stream":
+            url, send_one = f"{url}/stream", send_stream
+        else:
+            send_one = send
+        bodies = list(request_bodies(args.requests, args.same_address, args.backend, args.radius_km,
+                                      args.viz_formats))
+
+        try:
+            with RSSSampler() as rss, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(lambda body: send_one(url, body), bodies))
+                elapsed_s = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            services.shutdown()
+
+        ok = [r for r in results if r["status"] == 200]
+        errors = {}
+        for r in results:
+            if r["status"] != 200:
+                message = f"{r['status']}: {r['payload'].get('message', '')}"
+                errors[message] = errors.get(message, 0) + 1
+        stages = {}
+        for r in ok:
+            for name, record in r["payload"].get("profile", {}).get("stages", {}).items():
+                stages.setdefault(name, []).append(record["wall_s"])
+        first_stage_s = [r["first_stage_s"] for r in results if r.get("first_stage_s") is not None]
+
+        write_report({
+            "suite": "load",
+            "environment": environment_info(),
+            "config": {
+                "endpoint": args.endpoint, "requests": args.requests, "concurrency": args.concurrency, "backend": args.backend,
+                "radius_km": args.radius_km, "viz_formats": main.VIZ_DEFAULT_FORMATS if args.viz_formats is None else args.viz_formats, "same_address": args.same_address,
+                "dem_cache": not args.no_dem_cache, "service_latency_s": args.latency
+            },
+            "results": {
+                "elapsed_s": round(elapsed_s, 3),
+                "throughput_rps": round(len(ok) / elapsed_s, 4),
+                "succeeded": len(ok),
+                "failed": len(results) - len(ok),
+                "errors": errors,
+                "cache_hits": sum(1 for r in ok if r["payload"].get("cache_hit")),
+                "latency_s": summarize([r["latency_s"] for r in ok]),
+                "first_stage_s": summarize(first_stage_s),
+                "peak_rss_mb": round(rss.peak_bytes / 1024 / 1024, 1),
+                "stage_wall_s_mean": {name: round(float(np.mean(v)), 4) for name, v in sorted(stages.items())},
+            },
+        }, output)
+    if len(ok) < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,276 @@
+"""Micro-benchmarks of the individual pipeline functions on synthetic terrain.
+
+    python -m benchmarks.micro --sizes 256 1024 --terrains plane fractal --repeats 3 --output micro.json
+
+Each function runs under main.StageProfiler, so wall time and peak RSS are
+measured the same way as the per-stage profile of a /process response.
+
+Before timing, the level-pool fill of main.StageVolumeCurve is checked against
+the iterative loop it replaced, and the D8 receivers, flow accumulation and
+watershed mask of the numpy backend against WhiteboxTools on the same
+depression-filled DEM. The report lists each comparison under "checks" and the
+command exits non-zero if any of them disagrees. The WhiteboxTools check is
+recorded as skipped when its binary is not available.
+"""
+import os
+import sys
+import math
+import argparse
+import tempfile
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from benchmarks.common import environment_info, import_main, summarize, write_report
+from benchmarks.terrain import ARC_SECOND, SIZES, TERRAINS, synthetic_landcover, write_raster
+
+WEST, NORTH = 90.0, 24.0  # top-left corner of every synthetic DEM
+FLOOD_Q_FT3_S = 2000.0  # fixed scenario so flood timings are comparable between runs
+FLOOD_HOURS = 24
+CHECK_SIZE = 128  # the legacy loop makes one full-grid pass per metre of fill
+CHECK_FILL_FRACTIONS = (0.001, 0.01, 0.1, 0.5)  # of the volume that fills the DEM to its highest cell
+CHECK_RTOL = 1e-4  # the legacy loop accumulates depth in float32
+CHECK_D8_MIN_AGREEMENT = 0.99  # share of cells; equally steep neighbours may be chosen differently
+
+
+def tile_for(lon, lat, z):
+    """XYZ tile containing a lon/lat point."""
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def legacy_flood_fill(dem, areas, volume_m3):
+    """Flood depth from the pre-StageVolumeCurve loop of calculate_flood_depth.
+
+    Each pass raises every cell at the lowest water surface by one metre, so
+    the result is an exact level-pool fill only on integer elevations.
+    """
+    water_depth = np.zeros_like(dem, dtype=np.float32)
+    remaining_volume = volume_m3
+    while remaining_volume > 0:
+        min_elevation = np.nanmin(dem + water_depth)
+        flood_cells = (dem + water_depth == min_elevation)
+        volume_per_meter = areas[flood_cells].sum()
+        if remaining_volume >= volume_per_meter:
+            water_depth[flood_cells] += 1
+            remaining_volume -= volume_per_meter
+        else:
+            water_depth[flood_cells] += remaining_volume / volume_per_meter
+            remaining_volume = 0
+    return water_depth
+
+
+def check_stage_volume_curve(main, terrain):
+    """Compare flooded area and volume of StageVolumeCurve and the legacy loop on an integer DEM."""
+    dem = np.round(TERRAINS[terrain](CHECK_SIZE)).astype(np.float64)
+    transform = from_origin(WEST, NORTH, ARC_SECOND, ARC_SECOND)
+    areas = np.broadcast_to(main.cell_areas_m2(transform, CRS.from_epsg(4326), CHECK_SIZE)[:, None], dem.shape)
+    curve = main.StageVolumeCurve(dem, areas)
+    checks = []
+    for fraction in CHECK_FILL_FRACTIONS:
+        volume_m3 = fraction * curve.volumes[-1]
+        legacy_depth = legacy_flood_fill(dem, areas, volume_m3)
+        stage = float(curve.stage_for_volume(volume_m3))
+        depth = curve.depth(dem, stage)
+        legacy = {"area_m2": float(areas[legacy_depth > 0].sum()),
+                  "volume_m3": float(np.sum(legacy_depth * areas))}
+        curve_result = {"area_m2": float(curve.flooded_area_at_stage(stage)),
+                        "volume_m3": float(np.sum(depth * areas))}
+        ok = all(np.isclose(curve_result[key], legacy[key], rtol=CHECK_RTOL) for key in legacy)
+        checks.append({"check": "stage_volume_curve_vs_legacy_loop", "terrain": terrain, "size": CHECK_SIZE,
+                       "fill_fraction": fraction, "target_volume_m3": round(volume_m3, 1),
+                       "legacy": legacy, "stage_volume_curve": curve_result, "ok": bool(ok)})
+        if not ok:
+            main.logger.error(f"{terrain} fill {fraction}: StageVolumeCurve {curve_result} != legacy {legacy}")
+    return checks
+
+
+def check_whitebox_backend(main, terrain, workdir):
+    """Compare D8 receivers, flow accumulation and watershed mask of the numpy backend and WhiteboxTools.
+
+    Both run on the same Priority-Flood-filled DEM, so breaching (WhiteboxTools)
+    versus filling (numpy) does not enter the comparison.
+    """
+    record = {"check": "numpy_vs_whitebox", "terrain": terrain, "size": CHECK_SIZE}
+    try:
+        wbt = main._get_wbt()
+    except Exception as e:  # the binary is downloaded on first use
+        main.logger.warning(f"WhiteboxTools unavailable, skipping the backend comparison: {str(e)}")
+        return [dict(record, skipped=f"WhiteboxTools unavailable: {str(e)}", ok=True)]
+
+    case_dir = os.path.join(workdir, f"check_whitebox_{terrain}")
+    os.makedirs(case_dir, exist_ok=True)
+    wbt.set_working_dir(case_dir)
+    paths = main.build_file_paths(case_dir)
+    filled = main._priority_flood(TERRAINS[terrain](CHECK_SIZE).astype(np.float64), main.FILL_EPSILON)
+    write_raster(paths["filled_dem"], filled, WEST, NORTH)  # float64, so the ε gradient on flats survives
+
+    with main.rasterio.open(paths["filled_dem"]) as src:
+        cell_size_x, cell_size_y = main.cell_sizes_m(src.transform, src.crs, CHECK_SIZE)
+    receiver = main.d8_receivers(main.d8_pointer_array(filled, cell_size_x, cell_size_y))
+    levels = main.d8_topological_levels(receiver)
+    acc = main.d8_flow_accumulation_array(receiver, levels, ~np.isnan(filled))
+    outlet = int(np.argmax(acc))
+    ws = main.upstream_mask(receiver, levels, outlet, filled.shape)
+
+    wbt.d8_pointer(dem=paths["filled_dem"], output=paths["flow_dir"])
+    wbt.d8_flow_accumulation(paths["filled_dem"], paths["flow_acc"], out_type="cells")
+    import geopandas as gpd
+    from shapely.geometry import Point
+    r, c = np.unravel_index(outlet, filled.shape)
+    point = Point(WEST + (c + 0.5) * ARC_SECOND, NORTH - (r + 0.5) * ARC_SECOND)
+    gpd.GeoDataFrame({"id": [1]}, geometry=[point], crs="EPSG:4326").to_file(paths["pour_point_shp"])
+    wbt.watershed(d8_pntr=paths["flow_dir"], pour_pts=paths["pour_point_shp"], output=paths["watershed_tif"])
+    missing = [key for key in ("flow_dir", "flow_acc", "watershed_tif") if not os.path.exists(paths[key])]
+    if missing:
+        main.logger.error(f"{terrain}: WhiteboxTools did not write {', '.join(missing)}")
+        return [dict(record, error=f"WhiteboxTools did not write {', '.join(missing)}", ok=False)]
+
+    with main.rasterio.open(paths["flow_dir"]) as src:
+        wbt_receiver = main.d8_receivers(src.read(1, masked=True).filled(0).astype(np.int16))
+    with main.rasterio.open(paths["flow_acc"]) as src:
+        wbt_acc = src.read(1, masked=True).filled(0).astype(np.float64)
+    with main.rasterio.open(paths["watershed_tif"]) as src:
+        wbt_ws = src.read(1, masked=True).filled(0) > 0
+    agreement = {
+        "receivers": float(np.mean(receiver == wbt_receiver)),
+        "flow_accumulation": float(np.mean(np.isclose(acc, wbt_acc))),
+        "watershed_mask": float(np.sum(ws & wbt_ws) / max(np.sum(ws | wbt_ws), 1)),  # intersection over union
+    }
+    ok = all(value >= CHECK_D8_MIN_AGREEMENT for value in agreement.values())
+    if not ok:
+        main.logger.error(f"{terrain}: numpy and WhiteboxTools disagree: {agreement}")
+    return [dict(record, agreement={key: round(value, 6) for key, value in agreement.items()},
+                 watershed_cells={"numpy": int(ws.sum()), "whitebox": int(wbt_ws.sum())}, ok=bool(ok))]
+
+
+def bench_case(main, terrain, size, repeats, workdir):
+    """Run every benchmark on one terrain/size and return one result dict per function."""
+    case_dir = os.path.join(workdir, f"{terrain}_{size}")
+    os.makedirs(case_dir, exist_ok=True)
+    paths = main.build_file_paths(case_dir)
+    write_raster(paths["dem"], TERRAINS[terrain](size), WEST, NORTH, nodata=-32768.0)
+    landcover_dir = os.path.join(case_dir, "landcover")
+    os.makedirs(landcover_dir, exist_ok=True)
+    write_raster(os.path.join(landcover_dir, "landcover.tif"), synthetic_landcover((size, size)), WEST, NORTH)
+    main.LANDCOVER_DIR = landcover_dir
+
+    with main.rasterio.open(paths["dem"]) as src:
+        dem = src.read(1).astype(np.float64)
+        transform, crs = src.transform, src.crs
+    cell_size_x, cell_size_y = main.cell_sizes_m(transform, crs, size)
+    areas = np.broadcast_to(main.cell_areas_m2(transform, crs, size)[:, None], dem.shape)
+    state = {}
+
+    def priority_flood():
+        state["filled"] = main._priority_flood(dem, main.FILL_EPSILON)
+
+    def d8_pointer():
+        state["pointer"] = main.d8_pointer_array(state["filled"], cell_size_x, cell_size_y)
+
+    def d8_levels():
+        state["receiver"] = main.d8_receivers(state["pointer"])
+        state["levels"] = main.d8_topological_levels(state["receiver"])
+
+    def flow_accumulation():
+        main.d8_flow_accumulation_array(state["receiver"], state["levels"], ~np.isnan(state["filled"]))
+
+    def stage_volume_curve():
+        curve = main.StageVolumeCurve(state["filled"], areas)
+        curve.stage_for_volume(np.linspace(0, curve.volumes[-1], 100))
+
+    def process_watershed_numpy():
+        state["found"], _ = main.process_watershed_numpy(paths["dem"], paths)
+
+    def process_landcover():
+        main.process_landcover(paths)
+
+    def calculate_flood_depth():
+        main.calculate_flood_depth(FLOOD_Q_FT3_S, FLOOD_HOURS, paths, extent="bbox")
+
+    z = int(np.clip(round(math.log2(360 / (size * ARC_SECOND))), 0, main.TILE_MAX_ZOOM))
+    centre = size * ARC_SECOND / 2
+    tile = (z, *tile_for(WEST + centre, NORTH - centre, z))
+
+    def render_tile():
+        main.render_tile(paths["dem"], "dem", *tile)
+
+    benchmarks = [
+        ("priority_flood", priority_flood),
+        ("d8_pointer", d8_pointer),
+        ("d8_levels", d8_levels),
+        ("flow_accumulation", flow_accumulation),
+        ("stage_volume_curve", stage_volume_curve),
+        ("process_watershed_numpy", process_watershed_numpy),
+        ("process_landcover", process_landcover),
+        ("calculate_flood_depth", calculate_flood_depth),
+        ("render_tile", render_tile),
+    ]
+    results = []
+    for name, func in benchmarks:
+        if name == "process_landcover" and not state.get("found"):
+            results.append({"benchmark": name, "terrain": terrain, "size": size,
+                            "skipped": main.NO_CHANNEL_MESSAGE})
+            continue
+        walls, peaks = [], []
+        for _ in range(repeats):
+            profiler = main.StageProfiler()
+            with profiler.activate(), profiler.stage(name):
+                func()
+            walls.append(profiler.stages[name]["wall_s"])
+            peaks.append(profiler.stages[name]["peak_rss_mb"])
+        wall = summarize(walls)
+        results.append({
+            "benchmark": name,
+            "terrain": terrain,
+            "size": size,
+            "cells": size * size,
+            "repeats": repeats,
+            "wall_s": wall,
+            "peak_rss_mb": max(peaks),
+            "cells_per_s": round(size * size / wall["median"]) if wall["median"] > 0 else None,
+        })
+        main.logger.info(f"{terrain} {size}² {name}: {wall['median']:.3f} s")
+    return results
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of Flood-Factor pipeline functions")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 1024, 2048],
+                        help=f"DEM edge lengths in cells (suite: {' '.join(map(str, SIZES))})")
+    parser.add_argument("--terrains", nargs="+", choices=sorted(TERRAINS), default=sorted(TERRAINS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory(prefix="floodfactor-bench-") as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        main = import_main(workdir)
+        main.LANDCOVER_LEGACY_FILE = os.path.join(workdir, "merged_landcover.tif")  # never the repo's file
+        main._priority_flood(np.zeros((3, 3)), main.FILL_EPSILON)  # JIT-compile outside the timings
+
+        checks = [c for terrain in args.terrains for c in check_stage_volume_curve(main, terrain)]
+        checks += [c for terrain in args.terrains for c in check_whitebox_backend(main, terrain, workdir)]
+        results = []
+        for size in args.sizes:
+            for terrain in args.terrains:
+                results.extend(bench_case(main, terrain, size, args.repeats, workdir))
+        write_report({
+            "suite": "micro",
+            "environment": environment_info(),
+            "config": {"sizes": args.sizes, "terrains": args.terrains, "repeats": args.repeats,
+                       "chunk_rows": main.CHUNK_ROWS},
+            "checks": checks,
+            "results": results,
+        }, output)
+    if not all(c["ok"] for c in checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,81 @@
+"""Synthetic terrain and landcover generators for benchmarks."""
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+ARC_SECOND = 1 / 3600
+SIZES = (256, 1024, 2048, 4096, 8192)
+LANDCOVER_CLASSES = (10, 20, 30, 40, 50, 60, 80, 90)
+
+
+def tilted_plane(n, slope=0.02, noise=0.5, seed=0):
+    """Plane falling towards the south-east corner with white noise (many shallow pits)."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n)[None, :]
+    y = np.arange(n)[:, None]
+    z = 100 + slope * 30 * (2 * n - x - y) + noise * rng.random((n, n))
+    return z.astype(np.float32)
+
+
+def bowl(n, depth=50.0, noise=0.5, seed=0):
+    """Closed radial depression: one large pit that depression filling must flood completely."""
+    rng = np.random.default_rng(seed)
+    c = (n - 1) / 2
+    r2 = ((np.arange(n)[None, :] - c) ** 2 + (np.arange(n)[:, None] - c) ** 2) / c ** 2
+    z = 100 - depth * (1 - np.minimum(r2, 1)) + noise * rng.random((n, n))
+    return z.astype(np.float32)
+
+
+def fractal_valleys(n, hurst=0.8, relief=60.0, seed=0):
+    """Spectral (1/f) fractal surface cut by a V-shaped main valley, giving dendritic drainage."""
+    rng = np.random.default_rng(seed)
+    k = np.hypot(np.fft.fftfreq(n)[:, None], np.fft.rfftfreq(n)[None, :])
+    k[0, 0] = 1.0
+    amplitude = k ** -(hurst + 1)
+    amplitude[0, 0] = 0.0
+    spectrum = amplitude * np.exp(1j * rng.uniform(0, 2 * np.pi, k.shape))
+    surface = np.fft.irfft2(spectrum, s=(n, n))
+    surface = (surface - surface.min()) / np.ptp(surface) * relief
+    valley = 0.5 * relief * np.abs(np.arange(n) - n / 2)[None, :] / (n / 2) \
+        + 0.25 * relief * np.arange(n)[:, None] / n
+    return (surface + valley).astype(np.float32)
+
+
+TERRAINS = {
+    "plane": tilted_plane,
+    "bowl": bowl,
+    "fractal": fractal_valleys,
+}
+
+
+def terrain_at(lon, lat):
+    """Elevation (m) defined on lon/lat, so adjacent DEM requests and cache tiles line up.
+
+    Valleys run north–south every 0.1° of longitude and the land rises northwards.
+    """
+    lon = np.asarray(lon, dtype=np.float64)[None, :]
+    lat = np.asarray(lat, dtype=np.float64)[:, None]
+    z = 10 + 50 * (lat - 20) + 150 * np.abs(np.sin(np.pi * lon * 10)) \
+        + 4 * np.sin(lon * 700) * np.cos(lat * 650)
+    return z.astype(np.int16)
+
+
+def synthetic_landcover(shape, patch=10, seed=0):
+    """Patchy landcover classes (ESA WorldCover codes) with a few unknown (0) cells."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.choice(LANDCOVER_CLASSES, size=(-(-shape[0] // patch), -(-shape[1] // patch)))
+    classes = np.repeat(np.repeat(coarse, patch, axis=0), patch, axis=1)[:shape[0], :shape[1]]
+    classes[rng.random(shape) < 0.01] = 0
+    return classes.astype(np.uint8)
+
+
+def write_raster(path, array, west, north, res=ARC_SECOND, nodata=None):
+    """Write a single-band EPSG:4326 GeoTIFF with its top-left corner at (west, north)."""
+    profile = {
+        "driver": "GTiff", "height": array.shape[0], "width": array.shape[1], "count": 1,
+        "dtype": array.dtype.name, "crs": "EPSG:4326", "nodata": nodata,
+        "transform": from_origin(west, north, res, res), "tiled": True, "compress": "deflate"
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(array, 1)
+    return path
@@ -1,20 +1,34 @@
 import os
+import re
+import time
+import uuid
+import io
+import json
+import hashlib
+import functools
+import math
+import heapq
+import argparse
+import shutil
+import queue
+import threading
+import contextvars
+import multiprocessing
+from contextlib import ExitStack, contextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import rasterio
+import rasterio.shutil
 import requests
 import numpy as np
-import pyvista as pv
-import matplotlib
-matplotlib.use('Agg')  # Set non-interactive backend
-import matplotlib.pyplot as plt
-from rasterio.plot import show
-from scipy.ndimage import zoom
-from whitebox import WhiteboxTools
-from geopy.geocoders import Nominatim
-from rasterio.windows import from_bounds
-import geopandas as gpd
-import pandas as pd
-from shapely.geometry import Point
-from flask import Flask, request, jsonify, send_from_directory
+from rasterio.windows import Window, from_bounds, bounds as window_bounds, transform as window_transform
+from rasterio.merge import merge
+from rasterio.features import geometry_mask
+from rasterio.transform import from_bounds as transform_from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, transform_bounds, transform_geom
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import logging
 from dotenv import load_dotenv
@@ -23,6 +37,11 @@ import warnings
 # Suppress PyVista warning
 warnings.filterwarnings('ignore', category=UserWarning, message='Points is not a float type')
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 # Load environment variables
 load_dotenv()
 
@@ -37,57 +56,802 @@ CORS(app)
 OUTPUT_DIR = os.path.abspath("output_files")  # Absolute path for output directory
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# File paths (all absolute)
-FILE_PATHS = {
-    "filled_dem": os.path.abspath(os.path.join(OUTPUT_DIR, "filled_dem.tif")),
-    "flow_dir": os.path.abspath(os.path.join(OUTPUT_DIR, "flow_dir.tif")),
-    "flow_acc": os.path.abspath(os.path.join(OUTPUT_DIR, "flow_acc.tif")),
-    "streams": os.path.abspath(os.path.join(OUTPUT_DIR, "streams.tif")),
-    "pour_point_shp": os.path.abspath(os.path.join(OUTPUT_DIR, "pour_point.shp")),
-    "snapped_pp_shp": os.path.abspath(os.path.join(OUTPUT_DIR, "snapped_pp_shp.shp")),
-    "watershed_tif": os.path.abspath(os.path.join(OUTPUT_DIR, "watershed.tif")),
-    "c_factor_tif": os.path.abspath(os.path.join(OUTPUT_DIR, "C_factor_watershed.tif")),
-    "flood_depth": os.path.abspath(os.path.join(OUTPUT_DIR, "flood_depth.tif")),
-    "inundation_mask": os.path.abspath(os.path.join(OUTPUT_DIR, "flood_inundation_mask.tif")),
-    "flood_depth_png": os.path.abspath(os.path.join(OUTPUT_DIR, "flood_depth_map.png")),
-    "dem_user_png": os.path.abspath(os.path.join(OUTPUT_DIR, "dem_user.png")),
-    "landcover_c_factor_png": os.path.abspath(os.path.join(OUTPUT_DIR, "landcover_c_factor.png")),
-    "flood_visualization": os.path.abspath(os.path.join(OUTPUT_DIR, "flood_visualization.html")),
+# Workspace layout: every request writes into its own job directory
+JOBS_DIR = os.path.join(OUTPUT_DIR, "jobs")
+os.makedirs(JOBS_DIR, exist_ok=True)
+WORKSPACE_MAX_AGE_HOURS = float(os.getenv("WORKSPACE_MAX_AGE_HOURS", 24))
+WORKSPACE_MAX_TOTAL_MB = float(os.getenv("WORKSPACE_MAX_TOTAL_MB", 5000))
+WORKSPACE_CLEANUP_INTERVAL_S = float(os.getenv("WORKSPACE_CLEANUP_INTERVAL_S", 60))
+
+# File names of every pipeline product inside a workspace
+FILE_NAMES = {
+    "dem": "dem_user.tif",
+    "filled_dem": "filled_dem.tif",
+    "flow_dir": "flow_dir.tif",
+    "flow_acc": "flow_acc.tif",
+    "streams": "streams.tif",
+    "pour_point_shp": "pour_point.shp",
+    "snapped_pp_shp": "snapped_pp_shp.shp",
+    "watershed_tif": "watershed.tif",
+    "basins_tif": "basins.tif",
+    "c_factor_tif": "C_factor_watershed.tif",
+    "flood_depth": "flood_depth.tif",
+    "flood_depth_batch": "flood_depth_batch.tif",
+    "flood_depth_series": "flood_depth_series.tif",
+    "inundation_mask": "flood_inundation_mask.tif",
+    "flood_depth_png": "flood_depth_map.png",
+    "dem_user_png": "dem_user.png",
+    "landcover_c_factor_png": "landcover_c_factor.png",
+    "flood_visualization": "flood_visualization.html",
+    "terrain_vtp": "terrain_lod.vtp",
+    "flood_surface_vtp": "flood_surface.vtp",
+    "flood_gltf": "flood_visualization.gltf",
+    "job_status": "job.json",
+}
+
+def build_file_paths(base_dir):
+    """Map every product key to an absolute path under base_dir."""
+    return {key: os.path.abspath(os.path.join(base_dir, name)) for key, name in FILE_NAMES.items()}
+
+# Default (shared) file paths, used when functions are called outside a request
+FILE_PATHS = build_file_paths(OUTPUT_DIR)
+
+# Raster outputs (Cloud-Optimized GeoTIFF)
+COG_COMPRESSION = os.getenv("COG_COMPRESSION", "DEFLATE")
+COG_BLOCKSIZE = 256  # internal tile size, equal to the map tile size
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", 512))  # rows per block in windowed raster passes
+
+# Area of interest
+AOI_RADIUS_KM = float(os.getenv("AOI_RADIUS_KM", 5))  # half-width of the box around an address (10 km × 10 km)
+MAX_AOI_KM2 = float(os.getenv("MAX_AOI_KM2", 10000))  # ~11 M cells at 1″: under 1 GB per pipeline (see README)
+EARTH_RADIUS_M = 6371008.8  # mean radius, for cell sizes on geographic grids
+
+# DEM tile cache: fixed tiles keyed by index, shared by all jobs
+DEM_CACHE_ENABLED = os.getenv("DEM_CACHE_ENABLED", "1") == "1"
+DEM_CACHE_DIR = os.path.abspath(os.getenv("DEM_CACHE_DIR", os.path.join(OUTPUT_DIR, "dem_cache")))
+os.makedirs(DEM_CACHE_DIR, exist_ok=True)
+DEM_CACHE_MAX_MB = float(os.getenv("DEM_CACHE_MAX_MB", 2000))
+DEM_TILE_DEG = float(os.getenv("DEM_TILE_DEG", 1.0))
+SEED_REGIONS = {
+    "bangladesh": (88.0, 20.5, 92.75, 26.75)  # west, south, east, north
+}
+
+# Landcover sources: a directory of (COG) tiles in any CRS, plus the legacy single mosaic in the CWD
+LANDCOVER_DIR = os.path.abspath(os.getenv("LANDCOVER_DIR", "landcover"))
+LANDCOVER_LEGACY_FILE = os.path.abspath("merged_landcover.tif")
+LANDCOVER_EXTENSIONS = (".tif", ".tiff", ".vrt")
+
+# Result caches
+GEOCODE_CACHE_TTL_S = float(os.getenv("GEOCODE_CACHE_TTL_S", 7 * 24 * 3600))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 10000))
+TERRAIN_CACHE_DIR = os.path.abspath(os.getenv("TERRAIN_CACHE_DIR", os.path.join(OUTPUT_DIR, "terrain_cache")))
+os.makedirs(TERRAIN_CACHE_DIR, exist_ok=True)
+TERRAIN_CACHE_TTL_S = float(os.getenv("TERRAIN_CACHE_TTL_S", 7 * 24 * 3600))
+TERRAIN_CACHE_MAX_MB = float(os.getenv("TERRAIN_CACHE_MAX_MB", 2000))
+TERRAIN_CACHE_DECIMALS = 4  # bbox rounding (~10 m) used in terrain cache keys
+TERRAIN_CACHE_VERSION = 6  # bump when the format of cached products changes
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", 3600))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+# Scenario-independent products reused from the terrain cache
+TERRAIN_PRODUCT_KEYS = [
+    "dem", "filled_dem", "flow_dir", "flow_acc", "streams", "watershed_tif", "c_factor_tif"
+]
+
+# Map tiles (XYZ, Web Mercator)
+TILE_SIZE = 256
+TILE_MAX_ZOOM = 22
+TILE_CACHE_TTL_S = float(os.getenv("TILE_CACHE_TTL_S", 3600))
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", 4096))
+# Rasters served as tiles: source product, colormap, fixed value range (None = data range)
+# and the value at or below which cells stay transparent
+TILE_LAYERS = {
+    "flood_depth": {"key": "flood_depth", "cmap": "Blues", "vmin": 0.0, "vmax": None,
+                    "min_visible": 0.0, "resampling": Resampling.bilinear},
+    "c_factor": {"key": "c_factor_tif", "cmap": "RdYlGn", "vmin": None, "vmax": None,
+                 "min_visible": None, "resampling": Resampling.nearest},
+    "dem": {"key": "dem", "cmap": "terrain", "vmin": None, "vmax": None,
+            "min_visible": None, "resampling": Resampling.bilinear},
 }
 
+# Instrumentation
+STAGE_LATENCY_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
 # Constants
 STREAM_THRESHOLD = 3000
-CELL_AREA_M2 = 30 * 30  # 30m x 30m resolution
+HYDROLOGY_BACKEND = os.getenv("HYDROLOGY_BACKEND", "whitebox")  # "whitebox" or "numpy"
+HYDROLOGY_BACKENDS = ("whitebox", "numpy")
+BASIN_MODE = os.getenv("BASIN_MODE", "single")  # "single" (largest catchment) or "multi"
+BASIN_MODES = ("single", "multi")
+BASIN_WORKERS = int(os.getenv("BASIN_WORKERS", 2))  # processes filling sub-basins in parallel
+FILL_EPSILON = 1e-5  # metres added per cell when draining filled flats
+# D8 neighbour offsets (row, col) and their WhiteboxTools pointer codes
+D8_DIRECTIONS = [
+    (-1, 1, 1), (0, 1, 2), (1, 1, 4), (1, 0, 8),
+    (1, -1, 16), (0, -1, 32), (-1, -1, 64), (-1, 0, 128)
+]
 API_KEY = os.getenv("OPENTOPOGRAPHY_API_KEY", "81ac76541b208f2e3a9a4c24e7bfc6bc")
+OPENTOPO_URL = os.getenv("OPENTOPO_URL", "https://portal.opentopography.org/API/globaldem")
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+DEM_TYPE = "SRTMGL1"
+DEM_DOWNLOAD_TIMEOUT = (10, 300)  # connect, read (seconds)
+DEM_CHUNK_BYTES = 1024 * 1024
 C_LOOKUP = {
     10: 0.10, 20: 0.15, 30: 0.20, 40: 0.30,
     50: 0.85, 60: 0.40, 70: 0.05, 80: 0.05,
     90: 0.25, 95: 0.10, 100: 0.20
 }
+C_LUT = np.full(256, np.nan, dtype=np.float32)  # landcover class code -> C-factor (NaN = unknown)
+C_LUT[list(C_LOOKUP)] = list(C_LOOKUP.values())
 DEFAULT_RAINFALL_INTENSITY = 2.0  # inches/hour
+DEFAULT_DURATION = 150  # hours
+FLOOD_EXTENT = os.getenv("FLOOD_EXTENT", "bbox")  # "bbox" or "watershed"
+FLOOD_EXTENTS = ("bbox", "watershed")
+ROUTING_MODE = os.getenv("ROUTING_MODE", "static")  # "static" (level-pool fill) or "hydrograph"
+ROUTING_MODES = ("static", "hydrograph")
+ROUTING_TIME_STEP_MIN = float(os.getenv("ROUTING_TIME_STEP_MIN", 5))
+ROUTING_SNAPSHOT_MIN = float(os.getenv("ROUTING_SNAPSHOT_MIN", 60))  # interval between depth bands
+ROUTING_RECESSION_H = float(os.getenv("ROUTING_RECESSION_H", 6))  # simulated time after the rain stops
+ROUTING_MAX_STEPS = int(os.getenv("ROUTING_MAX_STEPS", 10000))
+ROUTING_HILLSLOPE_VELOCITY_MS = float(os.getenv("ROUTING_HILLSLOPE_VELOCITY_MS", 0.1))
+ROUTING_CHANNEL_VELOCITY_MS = float(os.getenv("ROUTING_CHANNEL_VELOCITY_MS", 1.0))
+ROUTING_WET_DEPTH_M = 0.05  # peak depth at which a cell counts as inundated in hydrograph mode
+VIZ_MODE = os.getenv("VIZ_MODE", "lod")  # "lod" or "full"
+VIZ_MODES = ("lod", "full")
+VIZ_TARGET_TRIANGLES = int(os.getenv("VIZ_TARGET_TRIANGLES", 200_000))
+VIZ_FORMATS = ("html", "vtp", "gltf")
+VIZ_DEFAULT_FORMATS = [f for f in os.getenv("VIZ_DEFAULT_FORMATS", "html").split(",") if f]  # when a request names none
+VIZ_WORKERS = int(os.getenv("VIZ_WORKERS", 2))  # processes exporting HTML for requests served on threads
+BATCH_MAX_SCENARIOS = int(os.getenv("BATCH_MAX_SCENARIOS", 100))
+NO_CHANNEL_MESSAGE = "No significant channels detected in the watershed"
+
+# Job queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # concurrent pipeline runs
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 8))  # jobs allowed to wait for a worker
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "spawn")
+WARM_UP_STEPS = os.getenv("WARM_UP_STEPS")  # comma-separated override of warm_up()'s default steps
+JOB_RETRY_AFTER_S = 30
+PIPELINE_STAGES = ["geocode", "dem", "watershed", "landcover", "runoff", "flood", "visualization"]
+# Downloadable products that become available when each stage completes
+STAGE_PRODUCTS = {
+    "dem": ["dem", "dem_user_png"],
+    "watershed": ["streams", "watershed_tif"],
+    "landcover": ["c_factor_tif", "landcover_c_factor_png"],
+    "flood": ["flood_depth", "flood_depth_png", "inundation_mask", "basins_tif", "flood_depth_series"],
+    "visualization": ["flood_visualization", "terrain_vtp", "flood_surface_vtp", "flood_gltf"],
+}
+SSE_KEEPALIVE_S = 15  # comment line sent while a long stage runs, so proxies keep the stream open
+
+_last_workspace_cleanup = 0.0
+_open_workspaces = set()  # job ids whose pipeline is running in this process
+_workspaces_lock = threading.Lock()
+WORKSPACE_IN_USE_FILE = ".in_use"  # marks an open workspace for the other server processes
+
+def create_workspace(cleanup=True):
+    """Create an isolated workspace for one job and return (job_id, file paths).
+
+    The workspace is protected from eviction until release_workspace(job_id),
+    both in this process and, through a marker file, in every other process
+    sharing JOBS_DIR (e.g. the other gunicorn workers).
+    """
+    if cleanup:
+        cleanup_workspaces()
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    with _workspaces_lock:
+        _open_workspaces.add(job_id)
+    os.makedirs(job_dir)
+    open(os.path.join(job_dir, WORKSPACE_IN_USE_FILE), "w").close()
+    logger.info(f"Created workspace for job {job_id}: {job_dir}")
+    return job_id, build_file_paths(job_dir)
+
+def release_workspace(job_id):
+    """Allow cleanup_workspaces to evict a workspace once its pipeline has finished."""
+    try:
+        os.remove(os.path.join(JOBS_DIR, job_id, WORKSPACE_IN_USE_FILE))
+    except FileNotFoundError:
+        pass
+    with _workspaces_lock:
+        _open_workspaces.discard(job_id)
+
+def get_workspace_dir(job_id):
+    """Resolve a job id to its workspace directory, or None if unknown."""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+        return None
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    return job_dir if os.path.isdir(job_dir) else None
+
+def _dir_size_bytes(path):
+    """Total size of all files below path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _workspace_in_use(job_id, in_process):
+    """Whether a workspace belongs to a pipeline that is still running in any server process or job worker."""
+    if job_id in in_process or os.path.exists(os.path.join(JOBS_DIR, job_id, WORKSPACE_IN_USE_FILE)):
+        return True
+    status = read_job_status(job_id)
+    return status is not None and status.get("state") in ("queued", "running")
+
+def cleanup_workspaces(max_age_hours=None, max_total_mb=None, force=False):
+    """Evict job workspaces older than max_age_hours, then oldest-first until under max_total_mb.
+
+    Workspaces still in use (open in this process, or a queued or running job)
+    are never evicted for size, only once they are older than max_age_hours.
+    """
+    global _last_workspace_cleanup
+    now = time.time()
+    if not force and now - _last_workspace_cleanup < WORKSPACE_CLEANUP_INTERVAL_S:
+        return 0
+    _last_workspace_cleanup = now
+    max_age_hours = WORKSPACE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    max_total_mb = WORKSPACE_MAX_TOTAL_MB if max_total_mb is None else max_total_mb
+
+    workspaces = []
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        if os.path.isdir(path):
+            workspaces.append((os.path.getmtime(path), _dir_size_bytes(path), path))
+    workspaces.sort()
+    with _workspaces_lock:
+        in_process = set(_open_workspaces)
+    with _jobs_lock:  # never both locks at once: submit_job creates workspaces under _jobs_lock
+        in_process |= _active_jobs
+
+    removed = 0
+    total_bytes = sum(size for _, size, _ in workspaces)
+    for mtime, size, path in workspaces:
+        too_old = now - mtime > max_age_hours * 3600
+        too_big = total_bytes > max_total_mb * 1024 * 1024
+        if not too_old and (not too_big or _workspace_in_use(os.path.basename(path), in_process)):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} workspace(s); {total_bytes / 1e6:.1f} MB remain")
+    return removed
+
+def convert_to_cog(path, overview_resampling="average", **creation_options):
+    """Rewrite a raster in place as a tiled, compressed Cloud-Optimized GeoTIFF with overviews."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.cog.tif"
+    try:
+        rasterio.shutil.copy(
+            path, tmp_path, driver="COG", COMPRESS=COG_COMPRESSION, BLOCKSIZE=COG_BLOCKSIZE,
+            OVERVIEW_RESAMPLING=overview_resampling.upper(), BIGTIFF="IF_SAFER", **creation_options
+        )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@contextmanager
+def cog_writer(path, profile, overview_resampling="average", **creation_options):
+    """Open a tiled GeoTIFF for (windowed) writing that is turned into a COG on exit."""
+    profile = dict(profile, driver="GTiff", tiled=True, blockxsize=COG_BLOCKSIZE, blockysize=COG_BLOCKSIZE)
+    with rasterio.open(path, "w", **profile) as dst:
+        yield dst
+    convert_to_cog(path, overview_resampling, **creation_options)
+
+def iter_windows(height, width, block_rows=None, halo=0):
+    """Row-block windows covering a grid, with halo rows of context either side.
+
+    Yields (window, halo_window, inner): read halo_window, compute, then keep
+    rows [inner] of the result for window.
+    """
+    block_rows = block_rows or CHUNK_ROWS
+    for row_off in range(0, height, block_rows):
+        rows = min(block_rows, height - row_off)
+        top = max(row_off - halo, 0)
+        bottom = min(row_off + rows + halo, height)
+        yield (Window(0, row_off, width, rows), Window(0, top, width, bottom - top),
+               slice(row_off - top, row_off - top + rows))
+
+def cell_sizes_m(transform, crs, height):
+    """Per-row cell width and height in metres (on a sphere for geographic CRS)."""
+    if crs is not None and crs.is_geographic:
+        lat = transform.f + (np.arange(height) + 0.5) * transform.e
+        dx = EARTH_RADIUS_M * np.deg2rad(abs(transform.a)) * np.cos(np.deg2rad(lat))
+        return dx, np.full(height, EARTH_RADIUS_M * np.deg2rad(abs(transform.e)))
+    return np.full(height, abs(transform.a)), np.full(height, abs(transform.e))
+
+def cell_areas_m2(transform, crs, height):
+    """Per-row cell area in m², exact on a sphere for geographic CRS."""
+    if crs is not None and crs.is_geographic:
+        top = np.deg2rad(transform.f + np.arange(height) * transform.e)
+        bottom = np.deg2rad(transform.f + (np.arange(height) + 1) * transform.e)
+        return EARTH_RADIUS_M ** 2 * np.deg2rad(abs(transform.a)) * np.abs(np.sin(top) - np.sin(bottom))
+    return np.full(height, abs(transform.a * transform.e))
+
+def mask_to_polygon(path, polygon):
+    """Set the cells of a raster outside a lon/lat GeoJSON polygon to nodata, block by block."""
+    with rasterio.open(path, "r+") as dst:
+        if dst.nodata is None:
+            dst.nodata = -32768
+        geoms = [transform_geom("EPSG:4326", dst.crs, polygon)]
+        for window, _, _ in iter_windows(dst.height, dst.width):
+            outside = geometry_mask(geoms, out_shape=(window.height, window.width),
+                                    transform=dst.window_transform(window))
+            if outside.any():
+                block = dst.read(1, window=window)
+                block[outside] = dst.nodata
+                dst.write(block, 1, window=window)
+
+def download_url(job_id, paths, key):
+    """Download link for a product of a job."""
+    return f"/download/{job_id}/{os.path.basename(paths[key])}"
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, ttl_s, maxsize):
+        self.ttl_s = ttl_s
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, validate=None):
+        """Return the cached value, or None if missing, expired or rejected by validate."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic() and (validate is None or validate(value)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl_s
+            }
+
+GEOCODE_CACHE = TTLCache(GEOCODE_CACHE_TTL_S, GEOCODE_CACHE_SIZE)
+RESPONSE_CACHE = TTLCache(RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_SIZE)
+TILE_CACHE = TTLCache(TILE_CACHE_TTL_S, TILE_CACHE_SIZE)
+TERRAIN_CACHE_STATS = {"hits": 0, "misses": 0}
+_terrain_stats_lock = threading.Lock()
+
+def _count_terrain_cache(outcome):
+    with _terrain_stats_lock:
+        TERRAIN_CACHE_STATS[outcome] += 1
+
+def terrain_cache_key(bbox, hydrology_backend, polygon=None):
+    """Cache key for the scenario-independent products of a bounding box (and AOI polygon)."""
+    key = {
+        "bbox": [round(v, TERRAIN_CACHE_DECIMALS) for v in bbox],
+        "polygon": polygon,
+        "dem_type": DEM_TYPE,
+        "stream_threshold": STREAM_THRESHOLD,
+        "hydrology_backend": hydrology_backend,
+        "landcover": landcover_signature(),
+        "version": TERRAIN_CACHE_VERSION
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def load_terrain_products(cache_key, paths):
+    """Copy cached terrain products into a workspace; returns their metadata or None on a miss."""
+    entry_dir = os.path.join(TERRAIN_CACHE_DIR, cache_key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta["created_at"] > TERRAIN_CACHE_TTL_S:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            raise FileNotFoundError(meta_path)
+        for key in meta["products"]:
+            shutil.copy2(os.path.join(entry_dir, FILE_NAMES[key]), paths[key])
+    except (OSError, ValueError, KeyError):
+        _count_terrain_cache("misses")
+        return None
+    os.utime(entry_dir)  # mark as recently used for LRU eviction
+    _count_terrain_cache("hits")
+    logger.info(f"Terrain cache hit: {cache_key}")
+    return meta
+
+def store_terrain_products(cache_key, paths, meta):
+    """Save a workspace's terrain products under cache_key, then enforce the size cap."""
+    entry_dir = os.path.join(TERRAIN_CACHE_DIR, cache_key)
+    tmp_dir = os.path.join(TERRAIN_CACHE_DIR, f".{cache_key}.{uuid.uuid4().hex}.tmp")
+    os.makedirs(tmp_dir)
+    products = [key for key in TERRAIN_PRODUCT_KEYS if os.path.exists(paths[key])]
+    for key in products:
+        shutil.copy2(paths[key], os.path.join(tmp_dir, FILE_NAMES[key]))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(dict(meta, products=products, created_at=time.time()), f)
+    try:
+        os.rename(tmp_dir, entry_dir)  # atomic publish; loses harmlessly to a concurrent writer
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict_terrain_cache()
+
+def evict_terrain_cache(max_mb=None):
+    """Delete least recently used terrain cache entries until the cache fits in max_mb."""
+    max_mb = TERRAIN_CACHE_MAX_MB if max_mb is None else max_mb
+    entries = []
+    for name in os.listdir(TERRAIN_CACHE_DIR):
+        path = os.path.join(TERRAIN_CACHE_DIR, name)
+        if not name.startswith(".") and os.path.isdir(path):
+            entries.append((os.path.getmtime(path), _dir_size_bytes(path), path))
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total_bytes <= max_mb * 1024 * 1024:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} terrain cache entr{'y' if removed == 1 else 'ies'}")
+    return removed
+
+def response_cache_key(params):
+    """Cache key covering every input of a /process request."""
+    return json.dumps({
+        **params,
+        "address": (params["address"] or "").strip().lower(),
+        "stream_threshold": STREAM_THRESHOLD,
+        "dem_type": DEM_TYPE
+    }, sort_keys=True)
+
+def get_cached_response(params):
+    """Previous response for identical inputs whose workspace still exists, or None."""
+    return RESPONSE_CACHE.get(
+        response_cache_key(params),
+        validate=lambda response: get_workspace_dir(response["job_id"]) is not None
+    )
+
+def cache_stats():
+    """Hit/miss counters of every cache layer in this process."""
+    with _terrain_stats_lock:
+        terrain = dict(TERRAIN_CACHE_STATS)
+    return {
+        "geocode": GEOCODE_CACHE.stats(),
+        "terrain": terrain,
+        "response": RESPONSE_CACHE.stats(),
+        "tiles": TILE_CACHE.stats()
+    }
+
+def _read_io_counters():
+    """(bytes read, bytes written) by the calling thread, or None where /proc is unavailable."""
+    for path in ("/proc/thread-self/io", "/proc/self/io"):
+        try:
+            with open(path) as f:
+                counters = dict(line.split(":", 1) for line in f)
+            return int(counters["rchar"]), int(counters["wchar"])
+        except (OSError, KeyError, ValueError):
+            continue
+    return None
+
+def _read_child_usage():
+    """(bytes read, bytes written, peak RSS, CPU seconds) of finished child processes, e.g. WhiteboxTools.
+
+    The kernel reports children's I/O in 512-byte blocks and only their largest
+    peak RSS ever. Returns None where resource is unavailable.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (usage.ru_inblock * 512, usage.ru_oublock * 512, usage.ru_maxrss * 1024,
+            usage.ru_utime + usage.ru_stime)
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS high-water mark so the next stage is measured on its own."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _peak_rss_bytes():
+    """Peak resident set size of this process since the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+_open_stages = 0  # stages open in this process, across all profilers
+_rss_lock = threading.Lock()
+
+class StageProfiler:
+    """Records wall time, peak RSS and bytes read/written for each stage of one pipeline run.
+
+    Stages may nest (e.g. individual WhiteboxTools calls inside "watershed");
+    a parent's peak RSS includes its children's. The peak-RSS high-water mark is
+    process-wide, so it is only reset when no other profiler has a stage open;
+    under concurrent runs a stage's peak is an upper bound that can include the
+    other runs' memory.
+
+    Subprocesses that finish during a stage (WhiteboxTools tools) add their block
+    I/O to the stage's bytes read/written, and their peak RSS is recorded as
+    child_peak_rss_mb. The kernel keeps only the largest child peak ever, so
+    this is exact when a stage's child sets a new maximum and otherwise an upper bound.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._stack = []
+
+    @contextmanager
+    def activate(self):
+        """Make this the profiler that stage_timer() records into on this thread."""
+        token = _current_profiler.set(self)
+        try:
+            yield self
+        finally:
+            _current_profiler.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        global _open_stages
+        frame = {"peak": 0}
+        with _rss_lock:
+            if self._stack:
+                # Keep the parent's peak so far before the reset discards it
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], _peak_rss_bytes() or 0)
+            self._stack.append(frame)
+            _open_stages += 1
+            if _open_stages == len(self._stack):
+                _reset_peak_rss()
+        io_start = _read_io_counters()
+        child_start = _read_child_usage()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_s = time.perf_counter() - start
+            io_end = _read_io_counters()
+            child_end = _read_child_usage()
+            with _rss_lock:
+                _open_stages -= 1
+                self._stack.pop()
+                peak = max(_peak_rss_bytes() or 0, frame["peak"])
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            record = self.stages.setdefault(name, {
+                "wall_s": 0.0, "peak_rss_mb": 0.0, "child_peak_rss_mb": 0.0, "read_bytes": 0, "write_bytes": 0
+            })
+            record["wall_s"] = round(record["wall_s"] + wall_s, 4)
+            record["peak_rss_mb"] = round(max(record["peak_rss_mb"], peak / 1024 / 1024), 1)
+            if io_start is not None and io_end is not None:
+                record["read_bytes"] += io_end[0] - io_start[0]
+                record["write_bytes"] += io_end[1] - io_start[1]
+            if child_start is not None and child_end[3] > child_start[3]:  # a subprocess finished
+                record["read_bytes"] += child_end[0] - child_start[0]
+                record["write_bytes"] += child_end[1] - child_start[1]
+                record["child_peak_rss_mb"] = round(max(record["child_peak_rss_mb"], child_end[2] / 1024 / 1024), 1)
+
+_current_profiler = contextvars.ContextVar("current_profiler", default=None)
+
+@contextmanager
+def stage_timer(name):
+    """Profile a block as a pipeline stage if a StageProfiler is active, otherwise do nothing."""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+_stage_metrics = {}
+_metrics_lock = threading.Lock()
+
+def observe_stage_metrics(profile):
+    """Add one run's stage profile to the process-wide latency histograms."""
+    with _metrics_lock:
+        for name, record in profile.items():
+            metric = _stage_metrics.setdefault(name, {
+                "buckets": [0] * len(STAGE_LATENCY_BUCKETS_S), "sum": 0.0, "count": 0,
+                "read_bytes": 0, "write_bytes": 0, "peak_rss_mb": 0.0, "child_peak_rss_mb": 0.0
+            })
+            for i, bound in enumerate(STAGE_LATENCY_BUCKETS_S):
+                if record["wall_s"] <= bound:
+                    metric["buckets"][i] += 1
+            metric["sum"] += record["wall_s"]
+            metric["count"] += 1
+            metric["read_bytes"] += record["read_bytes"]
+            metric["write_bytes"] += record["write_bytes"]
+            metric["peak_rss_mb"] = max(metric["peak_rss_mb"], record["peak_rss_mb"])
+            metric["child_peak_rss_mb"] = max(metric["child_peak_rss_mb"], record.get("child_peak_rss_mb", 0.0))
+
+def render_metrics():
+    """Prometheus text exposition of stage latencies, I/O, memory and cache counters."""
+    lines = [
+        "# HELP floodfactor_stage_duration_seconds Wall time of each pipeline stage.",
+        "# TYPE floodfactor_stage_duration_seconds histogram"
+    ]
+    with _metrics_lock:
+        metrics = {name: dict(m, buckets=list(m["buckets"])) for name, m in _stage_metrics.items()}
+    for name, m in sorted(metrics.items()):
+        for bound, count in zip(STAGE_LATENCY_BUCKETS_S, m["buckets"]):
+            lines.append(f'floodfactor_stage_duration_seconds_bucket{{stage="{name}",le="{bound:g}"}} {count}')
+        lines.append(f'floodfactor_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {m["count"]}')
+        lines.append(f'floodfactor_stage_duration_seconds_sum{{stage="{name}"}} {m["sum"]:.6f}')
+        lines.append(f'floodfactor_stage_duration_seconds_count{{stage="{name}"}} {m["count"]}')
+    for metric, key, help_text in [
+        ("floodfactor_stage_read_bytes_total", "read_bytes", "Bytes read by each pipeline stage."),
+        ("floodfactor_stage_write_bytes_total", "write_bytes", "Bytes written by each pipeline stage.")
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{stage="{name}"}} {m[key]}' for name, m in sorted(metrics.items())]
+    lines += [
+        "# HELP floodfactor_stage_peak_rss_bytes Highest peak RSS observed during each stage.",
+        "# TYPE floodfactor_stage_peak_rss_bytes gauge"
+    ]
+    lines += [f'floodfactor_stage_peak_rss_bytes{{stage="{name}"}} {int(m["peak_rss_mb"] * 1024 * 1024)}'
+              for name, m in sorted(metrics.items())]
+    lines += [
+        "# HELP floodfactor_stage_child_peak_rss_bytes Highest peak RSS of subprocesses (WhiteboxTools) run by each stage.",
+        "# TYPE floodfactor_stage_child_peak_rss_bytes gauge"
+    ]
+    lines += [f'floodfactor_stage_child_peak_rss_bytes{{stage="{name}"}} {int(m["child_peak_rss_mb"] * 1024 * 1024)}'
+              for name, m in sorted(metrics.items())]
+    lines += [
+        "# HELP floodfactor_cache_requests_total Cache lookups by layer and outcome.",
+        "# TYPE floodfactor_cache_requests_total counter"
+    ]
+    for layer, stats in cache_stats().items():
+        lines.append(f'floodfactor_cache_requests_total{{cache="{layer}",outcome="hit"}} {stats["hits"]}')
+        lines.append(f'floodfactor_cache_requests_total{{cache="{layer}",outcome="miss"}} {stats["misses"]}')
+    with _jobs_lock:
+        active_jobs = len(_active_jobs)
+    lines += [
+        "# HELP floodfactor_active_jobs Jobs queued or running in the worker pool.",
+        "# TYPE floodfactor_active_jobs gauge",
+        f"floodfactor_active_jobs {active_jobs}"
+    ]
+    return "\n".join(lines) + "\n"
+
+# Heavy modules are imported on first use, so a worker only loads what its requests need;
+# warm_up() loads the common ones before the first request.
+_pyvista = None
+_pyvista_lock = threading.Lock()
+
+def _get_pyvista():
+    """Import PyVista and select its jupyter backend once per process.
+
+    Selecting the backend imports trame, which fails when two request threads race on it.
+    """
+    global _pyvista
+    with _pyvista_lock:
+        if _pyvista is None:
+            import pyvista as pv
+            pv.set_jupyter_backend('trame')
+            _pyvista = pv
+    return _pyvista
+
+@functools.lru_cache(maxsize=1)
+def _get_matplotlib():
+    """Import matplotlib with the non-interactive backend (pyplot's global state is not thread-safe)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    return matplotlib
+
+_geolocator = None
+_http_session = None
+_clients = threading.local()
+
+def _get_geolocator():
+    """Nominatim client shared by every request of this worker."""
+    global _geolocator
+    if _geolocator is None:
+        from geopy.geocoders import Nominatim
+        _geolocator = Nominatim(user_agent="watergate_app", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+    return _geolocator
+
+def _get_http_session():
+    """HTTP session for DEM downloads; keeps connections to OpenTopography alive between requests."""
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+    return _http_session
+
+def _get_wbt():
+    """WhiteboxTools handle of the calling thread (each run sets its own working directory on it)."""
+    wbt = getattr(_clients, "wbt", None)
+    if wbt is None:
+        from whitebox import WhiteboxTools
+        wbt = WhiteboxTools()
+        wbt.verbose = True
+        _clients.wbt = wbt
+    return wbt
+
+def warm_up(renders_3d=False):
+    """Import the modules and create the clients a pipeline run needs, before serving traffic.
+
+    Runs as the initializer of every job worker and before app.run(); under
+    gunicorn, call it from a post_worker_init hook. By default only what every
+    run uses is loaded: the geocoder, the HTTP session, the HYDROLOGY_BACKEND
+    and the landcover index. PyVista is added for processes that render 3D
+    output themselves (renders_3d, i.e. job workers) when VIZ_DEFAULT_FORMATS is
+    not empty. WARM_UP_STEPS (comma-separated step names) replaces the defaults,
+    e.g. to add "matplotlib" for a server that renders many map tiles. A step
+    that fails is only logged; the request that needs it will retry and report the error.
+    """
+    start = time.perf_counter()
+    steps = {
+        "geocoder": _get_geolocator,
+        "http_session": _get_http_session,
+        "hydrology": _get_wbt if HYDROLOGY_BACKEND == "whitebox"
+        else lambda: _priority_flood(np.zeros((3, 3)), FILL_EPSILON),  # loads the cached JIT compilation
+        "landcover_index": lambda: _landcover_index(()),  # shapely
+        "matplotlib": lambda: colormap_lut("Blues"),
+        "pyvista": _get_pyvista,
+    }
+    if WARM_UP_STEPS is not None:
+        names = [name.strip() for name in WARM_UP_STEPS.split(",") if name.strip()]
+    else:
+        names = ["geocoder", "http_session", "hydrology", "landcover_index"]
+        if renders_3d and VIZ_DEFAULT_FORMATS:
+            names.append("pyvista")
+    for name in names:
+        if name not in steps:
+            logger.warning(f"Unknown warm-up step '{name}'; choose from {', '.join(steps)}")
+            continue
+        try:
+            steps[name]()
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {str(e)}")
+    logger.info(f"Warm-up ({', '.join(names)}) finished in {time.perf_counter() - start:.2f} s")
 
 def geocode_location(address):
     """Geocode an address to (latitude, longitude)."""
+    cache_key = address.strip().lower()
+    cached = GEOCODE_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"Geocode cache hit for '{address}'")
+        return cached
     try:
-        geolocator = Nominatim(user_agent="watergate_app")
+        geolocator = _get_geolocator()
         full_address = f"{address}, Bangladesh"
         location = geolocator.geocode(full_address)
         if location is None:
             raise ValueError(f"Could not geocode '{full_address}'")
         logger.info(f"Geocoded '{address}' → lat={location.latitude:.6f}, lon={location.longitude:.6f}")
-        return float(location.latitude), float(location.longitude)
+        result = (float(location.latitude), float(location.longitude))
+        GEOCODE_CACHE.set(cache_key, result)
+        return result
     except Exception as e:
         logger.error(f"Geocoding error: {str(e)}")
         raise
 
-def get_bbox(lat, lon):
-    """Compute a bounding box (~100 km²) around a point."""
+def get_bbox(lat, lon, radius_km=None):
+    """Compute a square bounding box extending radius_km (default ~100 km² in total) around a point."""
+    half_size_m = (radius_km or AOI_RADIUS_KM) * 1000.0
     meters_per_deg_lat = 111_000.0
     meters_per_deg_lon = 111_000.0 * np.cos(np.deg2rad(lat))
-    delta_deg_lat = 10000.0 / meters_per_deg_lat
-    delta_deg_lon = 10000.0 / meters_per_deg_lon
-    half_lat = delta_deg_lat / 2.0
-    half_lon = delta_deg_lon / 2.0
+    half_lat = half_size_m / meters_per_deg_lat
+    half_lon = half_size_m / meters_per_deg_lon
     west = lon - half_lon
     east = lon + half_lon
     south = lat - half_lat
@@ -96,38 +860,422 @@ def get_bbox(lat, lon):
                 f"Size ≈ {(east-west)*111000:.0f} m × {(north-south)*111000:.0f} m")
     return float(west), float(south), float(east), float(north)
 
-def download_dem_opentopo(west, south, east, north, out_tif="dem_user.tif"):
-    """Download DEM from OpenTopography."""
-    out_path = os.path.abspath(os.path.join(OUTPUT_DIR, out_tif))
-    url = (
-        "https://portal.opentopography.org/API/globaldem?"
-        f"demtype=SRTMGL1&south={south}&north={north}&west={west}&east={east}"
-        f"&outputFormat=GTiff&API_Key={API_KEY}"
+def bbox_area_km2(bbox):
+    """Approximate area of a lon/lat bounding box in km²."""
+    west, south, east, north = bbox
+    return (east - west) * 111.0 * np.cos(np.deg2rad((south + north) / 2)) * (north - south) * 111.0
+
+def dem_tile_indices(west, south, east, north, tile_deg=DEM_TILE_DEG):
+    """(row, col) indices of every cache tile intersecting a bounding box."""
+    cols = range(math.floor(west / tile_deg), math.ceil(east / tile_deg))
+    rows = range(math.floor(south / tile_deg), math.ceil(north / tile_deg))
+    return [(iy, ix) for iy in rows for ix in cols]
+
+def dem_tile_path(iy, ix, tile_deg=DEM_TILE_DEG):
+    """Cache file of a tile; the name is derived from DEM type, tile size and index."""
+    return os.path.join(DEM_CACHE_DIR, f"{DEM_TYPE}_{tile_deg:g}deg_{iy}_{ix}.tif")
+
+def _download_dem_bbox(west, south, east, north, out_path):
+    """Stream a DEM for a bounding box from OpenTopography to disk in chunks."""
+    params = {
+        "demtype": DEM_TYPE, "south": south, "north": north, "west": west, "east": east,
+        "outputFormat": "GTiff", "API_Key": API_KEY
+    }
+    logger.info(f"Requesting DEM from OpenTopography: W={west}, S={south}, E={east}, N={north}")
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.part"
+    try:
+        with _get_http_session().get(OPENTOPO_URL, params=params, stream=True, timeout=DEM_DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=DEM_CHUNK_BYTES):
+                    f.write(chunk)
+        os.replace(tmp_path, out_path)  # atomic, so readers never see a partial tile
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
+
+def fetch_dem_tile(iy, ix, tile_deg=DEM_TILE_DEG):
+    """Return the cached tile, downloading it on a miss."""
+    tile_path = dem_tile_path(iy, ix, tile_deg)
+    if os.path.exists(tile_path):
+        os.utime(tile_path)  # mark as recently used for LRU eviction
+        logger.info(f"DEM tile cache hit: {os.path.basename(tile_path)}")
+        return tile_path
+    logger.info(f"DEM tile cache miss: {os.path.basename(tile_path)}")
+    return _download_dem_bbox(
+        ix * tile_deg, iy * tile_deg, (ix + 1) * tile_deg, (iy + 1) * tile_deg, tile_path
     )
-    logger.info(f"Requesting DEM from OpenTopography: {url}")
+
+def evict_dem_cache(max_mb=None, keep=()):
+    """Delete least recently used tiles until the cache fits in max_mb."""
+    max_mb = DEM_CACHE_MAX_MB if max_mb is None else max_mb
+    tiles = []
+    keep_bytes = 0
+    for name in os.listdir(DEM_CACHE_DIR):
+        path = os.path.join(DEM_CACHE_DIR, name)
+        if not name.endswith(".tif"):
+            continue
+        try:  # another worker may evict the tile between listdir and stat
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if path in keep:
+            keep_bytes += stat.st_size
+        else:
+            tiles.append((stat.st_mtime, stat.st_size, path))
+    tiles.sort()
+    total_bytes = sum(size for _, size, _ in tiles) + keep_bytes
+    removed = 0
+    for _, size, path in tiles:
+        if total_bytes <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} DEM tile(s) from cache")
+    return removed
+
+def download_dem_opentopo(west, south, east, north, paths=FILE_PATHS):
+    """Cut the DEM for a bounding box from cached tiles, downloading missing tiles."""
+    out_path = paths["dem"]
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        with open(out_path, "wb") as f:
-            f.write(r.content)
-        with rasterio.open(out_path) as src:
-            arr = src.read(1)
-            plt.figure(figsize=(6, 5))
-            show(arr, cmap="terrain", title=f"DEM for User Box ({out_tif})")
-            plt.tight_layout()
-            plt.savefig(FILE_PATHS["dem_user_png"], dpi=300, bbox_inches='tight')
-            plt.close()
+        if DEM_CACHE_ENABLED:
+            tile_paths = [fetch_dem_tile(iy, ix) for iy, ix in dem_tile_indices(west, south, east, north)]
+            sources = [rasterio.open(p) for p in tile_paths]
+            try:
+                mosaic, mosaic_transform = merge(sources, bounds=(west, south, east, north))
+                profile = sources[0].profile.copy()
+            finally:
+                for src in sources:
+                    src.close()
+            profile.update(
+                driver="GTiff", height=mosaic.shape[1], width=mosaic.shape[2],
+                transform=mosaic_transform, count=1
+            )
+            with rasterio.open(out_path, "w", **profile) as dst:
+                dst.write(mosaic[0], 1)
+            evict_dem_cache(keep=set(tile_paths))
+        else:
+            _download_dem_bbox(west, south, east, north, out_path)
         logger.info(f"DEM saved to: {out_path}")
         return out_path
     except Exception as e:
         logger.error(f"DEM download error: {str(e)}")
         raise
 
-def process_watershed(dem_path):
+def seed_dem_cache(west, south, east, north):
+    """Pre-download every cache tile covering a region so later requests run offline."""
+    tiles = dem_tile_indices(west, south, east, north)
+    logger.info(f"Seeding DEM cache with {len(tiles)} tile(s) of {DEM_TILE_DEG:g}°")
+    fetched, failed = 0, []
+    for iy, ix in tiles:
+        try:
+            fetch_dem_tile(iy, ix)
+            fetched += 1
+        except Exception as e:
+            logger.warning(f"Could not fetch DEM tile ({iy}, {ix}): {str(e)}")
+            failed.append((iy, ix))
+    cache_mb = _dir_size_bytes(DEM_CACHE_DIR) / 1024 / 1024
+    if cache_mb > DEM_CACHE_MAX_MB:
+        logger.warning(f"Seeded cache ({cache_mb:.0f} MB) exceeds DEM_CACHE_MAX_MB; "
+                       f"older tiles will be evicted on the next request")
+    logger.info(f"Seeded {fetched} tile(s), {len(failed)} failed")
+    return fetched, failed
+
+def _priority_flood_kernel(dem, epsilon):
+    """Priority-Flood+ε depression filling (Barnes et al., 2014).
+
+    Cells are visited from the raster edge (and nodata borders) inwards in
+    order of elevation; every cell is raised to at least epsilon above the
+    cell it was reached from, so filled flats still drain.
+    """
+    rows, cols = dem.shape
+    filled = dem.copy()
+    closed = np.zeros((rows, cols), dtype=np.bool_)
+    heap = [(np.inf, np.int64(-1))]  # typed seed entry, popped first
+    heap.pop()
+    for r in range(rows):
+        for c in range(cols):
+            if np.isnan(dem[r, c]):
+                closed[r, c] = True
+                continue
+            on_border = r == 0 or c == 0 or r == rows - 1 or c == cols - 1
+            if not on_border:
+                for dr in range(-1, 2):
+                    for dc in range(-1, 2):
+                        if np.isnan(dem[r + dr, c + dc]):
+                            on_border = True
+            if on_border:
+                closed[r, c] = True
+                heapq.heappush(heap, (filled[r, c], np.int64(r * cols + c)))
+    while len(heap) > 0:
+        z, idx = heapq.heappop(heap)
+        r, c = idx // cols, idx % cols
+        for dr in range(-1, 2):
+            for dc in range(-1, 2):
+                nr, nc = r + dr, c + dc
+                if nr < 0 or nc < 0 or nr >= rows or nc >= cols or closed[nr, nc]:
+                    continue
+                closed[nr, nc] = True
+                if filled[nr, nc] <= z:
+                    filled[nr, nc] = z + epsilon
+                heapq.heappush(heap, (filled[nr, nc], np.int64(nr * cols + nc)))
+    return filled
+
+@functools.lru_cache(maxsize=1)
+def _get_priority_flood():
+    """The Priority-Flood kernel, JIT-compiled with Numba when it is installed.
+
+    Numba (with llvmlite) adds tens of MB to a process, so it is imported the
+    first time the in-memory backend runs, not when the module is loaded.
+    """
+    try:
+        from numba import njit
+    except ImportError:  # Numba is optional; the kernel then runs as plain Python
+        return _priority_flood_kernel
+    return njit(cache=True)(_priority_flood_kernel)
+
+def _priority_flood(dem, epsilon):
+    return _get_priority_flood()(dem, epsilon)
+
+def d8_pointer_array(filled, cell_size_x=1.0, cell_size_y=1.0):
+    """D8 steepest-descent pointer in WhiteboxTools encoding (0 = no downslope neighbour).
+
+    Cell sizes may be scalars or per-row arrays. Rows are processed in blocks
+    with a one-row halo, so temporaries stay block-sized.
+    """
+    rows, cols = filled.shape
+    size_x = np.broadcast_to(np.asarray(cell_size_x, dtype=np.float64), (rows,))
+    size_y = np.broadcast_to(np.asarray(cell_size_y, dtype=np.float64), (rows,))
+    pointer = np.zeros(filled.shape, dtype=np.int16)
+    for window, halo_window, inner in iter_windows(rows, cols, halo=1):
+        block_rows, _ = halo_window.toslices()
+        block = filled[block_rows]
+        padded = np.pad(block, 1, constant_values=np.nan)
+        dx = size_x[block_rows][:, None]
+        dy = size_y[block_rows][:, None]
+        best_slope = np.zeros(block.shape, dtype=np.float64)
+        block_pointer = np.zeros(block.shape, dtype=np.int16)
+        for dr, dc, code in D8_DIRECTIONS:
+            neighbour = padded[1 + dr:1 + dr + block.shape[0], 1 + dc:1 + dc + cols]
+            distance = np.hypot(dr * dy, dc * dx)
+            with np.errstate(invalid="ignore"):
+                slope = (block - neighbour) / distance
+                steeper = slope > best_slope
+            best_slope[steeper] = slope[steeper]
+            block_pointer[steeper] = code
+        pointer[window.toslices()] = block_pointer[inner]
+    return pointer
+
+def d8_receivers(pointer):
+    """Flat index of the downstream cell of every cell, or -1 where flow leaves the grid.
+
+    Rows are processed in blocks so the index temporaries stay block-sized.
+    """
+    rows, cols = pointer.shape
+    index_dtype = np.int32 if pointer.size < 2 ** 31 else np.int64  # halves the global index arrays
+    receiver = np.full(pointer.size, -1, dtype=index_dtype)
+    for window, _, _ in iter_windows(rows, cols):
+        block = pointer[window.toslices()[0]].ravel()
+        offset = window.row_off * cols
+        for dr, dc, code in D8_DIRECTIONS:
+            idx = np.flatnonzero(block == code) + offset
+            nr, nc = idx // cols + dr, idx % cols + dc
+            inside = (nr >= 0) & (nr < rows) & (nc >= 0) & (nc < cols)
+            receiver[idx[inside]] = nr[inside] * cols + nc[inside]
+    return receiver
+
+def d8_topological_levels(receiver):
+    """Group cells into levels such that every cell comes after all of its donors.
+
+    Processing the levels in order (or in reverse) lets accumulation-style
+    passes run as a handful of vectorized operations per level.
+    """
+    has_receiver = receiver >= 0
+    indegree = np.bincount(receiver[has_receiver], minlength=receiver.size).astype(np.int32)
+    frontier = np.flatnonzero(indegree == 0).astype(receiver.dtype)
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        downstream = receiver[frontier]
+        downstream = downstream[downstream >= 0]
+        np.subtract.at(indegree, downstream, 1)
+        downstream = np.unique(downstream)
+        frontier = downstream[indegree[downstream] == 0]
+    return levels
+
+def d8_flow_accumulation_array(receiver, levels, valid):
+    """Number of cells draining through each cell, counting the cell itself."""
+    acc = valid.ravel().astype(np.float64)
+    for level in levels:
+        downstream = receiver[level]
+        has_receiver = downstream >= 0
+        np.add.at(acc, downstream[has_receiver], acc[level[has_receiver]])
+    return acc.reshape(valid.shape)
+
+def upstream_mask(receiver, levels, outlet_index, shape):
+    """Boolean mask of every cell that drains to the outlet cell."""
+    inside = np.zeros(receiver.size, dtype=bool)
+    inside[outlet_index] = True
+    for level in reversed(levels):
+        downstream = receiver[level]
+        has_receiver = downstream >= 0
+        inside[level[has_receiver]] |= inside[downstream[has_receiver]]
+    return inside.reshape(shape)
+
+def label_basins(receiver, levels, outlets, shape):
+    """Basin id of every cell draining to one of the outlet cells (ids from 1, 0 = none)."""
+    labels = np.zeros(receiver.size, dtype=np.int32)
+    labels[outlets] = np.arange(1, outlets.size + 1, dtype=np.int32)
+    for level in reversed(levels):
+        downstream = receiver[level]
+        has_receiver = downstream >= 0
+        labels[level[has_receiver]] = labels[downstream[has_receiver]]
+    return labels.reshape(shape)
+
+def delineate_basins(paths=FILE_PATHS):
+    """Label every sub-basin whose outlet drains at least STREAM_THRESHOLD cells.
+
+    Outlets are cells whose flow leaves the grid or ends without a downslope
+    neighbour. Works on the flow direction raster of either hydrology backend.
+    Returns one metadata dict per basin, largest first (basin ids 1..n).
+    """
+    with rasterio.open(paths["flow_dir"]) as src:
+        pointer = src.read(1)
+        profile = src.profile
+        transform = src.transform
+        valid = pointer != src.nodata if src.nodata is not None else np.ones(pointer.shape, dtype=bool)
+    pointer = np.where(valid, pointer, 0).astype(np.int16)
+
+    receiver = d8_receivers(pointer)
+    levels = d8_topological_levels(receiver)
+    acc = d8_flow_accumulation_array(receiver, levels, valid).ravel()
+    outlets = np.flatnonzero((receiver < 0) & valid.ravel() & (acc >= STREAM_THRESHOLD))
+    outlets = outlets[np.argsort(-acc[outlets], kind="stable")]
+    labels = label_basins(receiver, levels, outlets, pointer.shape)
+    labels[~valid] = 0
+
+    profile.update(dtype="int32", count=1, nodata=0)
+    with cog_writer(paths["basins_tif"], profile, "nearest") as dst:
+        dst.write(labels, 1)
+    logger.info(f"Delineated {outlets.size} sub-basin(s) draining at least {STREAM_THRESHOLD} cells")
+
+    row_areas = cell_areas_m2(transform, profile["crs"], labels.shape[0])
+    basin_areas = np.zeros(outlets.size + 1)
+    for window, _, _ in iter_windows(*labels.shape):
+        block = labels[window.toslices()]
+        weights = np.repeat(row_areas[window.toslices()[0]], block.shape[1])
+        basin_areas += np.bincount(block.ravel(), weights=weights, minlength=outlets.size + 1)
+    basins = []
+    for basin_id, outlet in enumerate(outlets, start=1):
+        r, c = np.unravel_index(outlet, pointer.shape)
+        lon, lat = transform * (c + 0.5, r + 0.5)
+        basins.append({
+            "basin_id": basin_id,
+            "outlet_latitude": float(lat),
+            "outlet_longitude": float(lon),
+            "area_m2": float(basin_areas[basin_id])
+        })
+    return basins
+
+def process_watershed(dem_path, paths=FILE_PATHS, backend=None):
+    """Perform watershed delineation with the selected hydrology backend."""
+    backend = backend or HYDROLOGY_BACKEND
+    if backend == "numpy":
+        return process_watershed_numpy(dem_path, paths)
+    if backend == "whitebox":
+        return process_watershed_whitebox(dem_path, paths)
+    raise ValueError(f"Unknown hydrology backend '{backend}'")
+
+def process_watershed_numpy(dem_path, paths=FILE_PATHS):
+    """Perform watershed delineation in memory, persisting only the rasters later stages read."""
+    dem_path = os.path.abspath(dem_path)
+    logger.info(f"Processing watershed in memory with DEM: {dem_path}")
+    if not os.path.exists(dem_path):
+        raise RuntimeError(f"Input DEM not found: {dem_path}")
+    with rasterio.open(dem_path) as src:
+        dem = src.read(1).astype(np.float64)
+        profile = src.profile
+        transform = src.transform
+        if src.nodata is not None:
+            dem[dem == src.nodata] = np.nan
+    cell_size_x, cell_size_y = cell_sizes_m(transform, profile["crs"], dem.shape[0])
+
+    logger.info("Filling depressions in DEM")
+    with stage_timer("watershed.priority_flood"):
+        filled = _priority_flood(dem, FILL_EPSILON)
+    del dem
+    valid = ~np.isnan(filled)
+
+    logger.info("Computing D8 flow direction")
+    with stage_timer("watershed.d8_pointer"):
+        pointer = d8_pointer_array(filled, cell_size_x, cell_size_y)
+
+    # Persist the filled DEM and pointer block by block, then drop the grids
+    # before the global index arrays are built
+    filled_profile = profile.copy()
+    filled_profile.update(dtype="float32", count=1, nodata=-32768.0)
+    with cog_writer(paths["filled_dem"], filled_profile, PREDICTOR="YES") as dst:
+        for window, _, _ in iter_windows(*filled.shape):
+            rows, _ = window.toslices()
+            dst.write(np.where(valid[rows], filled[rows], -32768.0).astype(np.float32), 1, window=window)
+    del filled
+    pointer_profile = profile.copy()
+    pointer_profile.update(dtype="int16", count=1, nodata=-32768)
+    with rasterio.open(paths["flow_dir"], "w", **pointer_profile) as dst:
+        for window, _, _ in iter_windows(*pointer.shape):
+            rows, _ = window.toslices()
+            dst.write(np.where(valid[rows], pointer[rows], -32768).astype(np.int16), 1, window=window)
+
+    with stage_timer("watershed.d8_topology"):
+        receiver = d8_receivers(pointer)
+        del pointer
+        levels = d8_topological_levels(receiver)
+
+    logger.info("Computing D8 flow accumulation")
+    with stage_timer("watershed.d8_flow_accumulation"):
+        flow_acc_arr = d8_flow_accumulation_array(receiver, levels, valid)
+    max_acc = np.nanmax(flow_acc_arr)
+    logger.info(f"Max flow-accumulation: {max_acc:.0f} cells")
+
+    if max_acc < STREAM_THRESHOLD:
+        logger.warning("No significant channels detected (flow_acc < threshold)")
+        return False, None
+
+    logger.info("Extracting streams")
+    mask_profile = profile.copy()
+    mask_profile.update(dtype="uint8", count=1, nodata=0)
+    with cog_writer(paths["streams"], mask_profile, "nearest", NBITS=1) as dst:
+        for window, _, _ in iter_windows(*flow_acc_arr.shape):
+            rows, _ = window.toslices()
+            dst.write((flow_acc_arr[rows] >= STREAM_THRESHOLD).astype(np.uint8), 1, window=window)
+
+    idx_flat = int(np.nanargmax(flow_acc_arr))
+    r, c = np.unravel_index(idx_flat, flow_acc_arr.shape)
+    lon_pp, lat_pp = (
+        transform.c + c * transform.a + transform.a/2,
+        transform.f + r * transform.e + transform.e/2
+    )
+    logger.info(f"Pour point: row={r}, col={c}, lon={lon_pp:.6f}, lat={lat_pp:.6f}")
+
+    logger.info("Delineating watershed")
+    ws = upstream_mask(receiver, levels, idx_flat, flow_acc_arr.shape)
+    with rasterio.open(paths["watershed_tif"], "w", **mask_profile) as dst:
+        dst.write(ws.astype(np.uint8), 1)
+    logger.info(f"Watershed saved: {paths['watershed_tif']}")
+
+    watershed_area_m2 = ws.sum(axis=1) @ cell_areas_m2(transform, profile["crs"], ws.shape[0])
+    return True, float(watershed_area_m2)
+
+def process_watershed_whitebox(dem_path, paths=FILE_PATHS):
     """Perform watershed delineation using WhiteboxTools."""
-    wbt = WhiteboxTools()
-    wbt.verbose = True
-    wbt.set_working_dir(OUTPUT_DIR)  # Set working directory to output_files
+    wbt = _get_wbt()
+    wbt.set_working_dir(os.path.dirname(paths["filled_dem"]))  # Work inside the job workspace
 
     # Ensure dem_path is absolute
     dem_path = os.path.abspath(dem_path)
@@ -137,24 +1285,27 @@ def process_watershed(dem_path):
     logger.info("Breaching depressions in DEM")
     if not os.path.exists(dem_path):
         raise RuntimeError(f"Input DEM not found: {dem_path}")
-    wbt.breach_depressions(dem=dem_path, output=FILE_PATHS["filled_dem"])
-    if not os.path.exists(FILE_PATHS["filled_dem"]):
-        raise RuntimeError(f"Failed to create filled_dem.tif: {FILE_PATHS['filled_dem']}")
+    with stage_timer("watershed.breach_depressions"):
+        wbt.breach_depressions(dem=dem_path, output=paths["filled_dem"])
+    if not os.path.exists(paths["filled_dem"]):
+        raise RuntimeError(f"Failed to create filled_dem.tif: {paths['filled_dem']}")
 
     # Compute D8 flow direction
     logger.info("Computing D8 flow direction")
-    wbt.d8_pointer(dem=FILE_PATHS["filled_dem"], output=FILE_PATHS["flow_dir"])
-    if not os.path.exists(FILE_PATHS["flow_dir"]):
-        raise RuntimeError(f"Failed to create flow_dir.tif: {FILE_PATHS['flow_dir']}")
+    with stage_timer("watershed.d8_pointer"):
+        wbt.d8_pointer(dem=paths["filled_dem"], output=paths["flow_dir"])
+    if not os.path.exists(paths["flow_dir"]):
+        raise RuntimeError(f"Failed to create flow_dir.tif: {paths['flow_dir']}")
 
     # Compute D8 flow accumulation
     logger.info("Computing D8 flow accumulation")
-    wbt.d8_flow_accumulation(FILE_PATHS["filled_dem"], FILE_PATHS["flow_acc"], out_type="cells")
-    if not os.path.exists(FILE_PATHS["flow_acc"]):
-        raise RuntimeError(f"Failed to create flow_acc.tif: {FILE_PATHS['flow_acc']}")
+    with stage_timer("watershed.d8_flow_accumulation"):
+        wbt.d8_flow_accumulation(paths["filled_dem"], paths["flow_acc"], out_type="cells")
+    if not os.path.exists(paths["flow_acc"]):
+        raise RuntimeError(f"Failed to create flow_acc.tif: {paths['flow_acc']}")
 
     # Read flow accumulation
-    with rasterio.open(FILE_PATHS["flow_acc"]) as src:
+    with rasterio.open(paths["flow_acc"]) as src:
         flow_acc_arr = src.read(1)
     max_acc = np.nanmax(flow_acc_arr)
     logger.info(f"Max flow-accumulation: {max_acc:.0f} cells")
@@ -165,12 +1316,13 @@ def process_watershed(dem_path):
 
     # Extract streams
     logger.info("Extracting streams")
-    wbt.extract_streams(flow_accum=FILE_PATHS["flow_acc"], output=FILE_PATHS["streams"], threshold=STREAM_THRESHOLD)
-    if not os.path.exists(FILE_PATHS["streams"]):
-        raise RuntimeError(f"Failed to create streams.tif: {FILE_PATHS['streams']}")
+    with stage_timer("watershed.extract_streams"):
+        wbt.extract_streams(flow_accum=paths["flow_acc"], output=paths["streams"], threshold=STREAM_THRESHOLD)
+    if not os.path.exists(paths["streams"]):
+        raise RuntimeError(f"Failed to create streams.tif: {paths['streams']}")
 
     # Identify pour point
-    with rasterio.open(FILE_PATHS["flow_acc"]) as src:
+    with rasterio.open(paths["flow_acc"]) as src:
         flow_acc_arr = src.read(1)
         transform = src.transform
     idx_flat = np.nanargmax(flow_acc_arr)
@@ -182,109 +1334,197 @@ def process_watershed(dem_path):
     logger.info(f"Pour point: row={r}, col={c}, lon={lon_pp:.6f}, lat={lat_pp:.6f}")
 
     # Create pour point shapefile
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import Point
     gdf = gpd.GeoDataFrame(
         pd.DataFrame({'id': [1]}),
         geometry=[Point(lon_pp, lat_pp)],
         crs="EPSG:4326"
     )
-    gdf.to_file(FILE_PATHS["pour_point_shp"])
-    logger.info(f"Pour point shapefile saved: {FILE_PATHS['pour_point_shp']}")
-    if not os.path.exists(FILE_PATHS["pour_point_shp"]):
-        raise RuntimeError(f"Failed to create pour_point.shp: {FILE_PATHS['pour_point_shp']}")
+    gdf.to_file(paths["pour_point_shp"])
+    logger.info(f"Pour point shapefile saved: {paths['pour_point_shp']}")
+    if not os.path.exists(paths["pour_point_shp"]):
+        raise RuntimeError(f"Failed to create pour_point.shp: {paths['pour_point_shp']}")
 
     # Snap pour points
     logger.info("Snapping pour points")
-    wbt.snap_pour_points(
-        pour_pts=FILE_PATHS["pour_point_shp"],
-        flow_accum=FILE_PATHS["flow_acc"],
-        output=FILE_PATHS["snapped_pp_shp"],
-        snap_dist=10
-    )
-    logger.info(f"Snapped pour point saved: {FILE_PATHS['snapped_pp_shp']}")
-    if not os.path.exists(FILE_PATHS["snapped_pp_shp"]):
-        raise RuntimeError(f"Failed to create snapped_pp_shp.shp: {FILE_PATHS['snapped_pp_shp']}")
+    with stage_timer("watershed.snap_pour_points"):
+        wbt.snap_pour_points(
+            pour_pts=paths["pour_point_shp"],
+            flow_accum=paths["flow_acc"],
+            output=paths["snapped_pp_shp"],
+            snap_dist=10
+        )
+    logger.info(f"Snapped pour point saved: {paths['snapped_pp_shp']}")
+    if not os.path.exists(paths["snapped_pp_shp"]):
+        raise RuntimeError(f"Failed to create snapped_pp_shp.shp: {paths['snapped_pp_shp']}")
 
     # Delineate watershed
     logger.info("Delineating watershed")
-    wbt.watershed(
-        d8_pntr=FILE_PATHS["flow_dir"],
-        pour_pts=FILE_PATHS["snapped_pp_shp"],
-        output=FILE_PATHS["watershed_tif"]
-    )
-    logger.info(f"Watershed saved: {FILE_PATHS['watershed_tif']}")
-    if not os.path.exists(FILE_PATHS["watershed_tif"]):
-        raise RuntimeError(f"Failed to create watershed.tif: {FILE_PATHS['watershed_tif']}")
+    with stage_timer("watershed.watershed"):
+        wbt.watershed(
+            d8_pntr=paths["flow_dir"],
+            pour_pts=paths["snapped_pp_shp"],
+            output=paths["watershed_tif"]
+        )
+    logger.info(f"Watershed saved: {paths['watershed_tif']}")
+    if not os.path.exists(paths["watershed_tif"]):
+        raise RuntimeError(f"Failed to create watershed.tif: {paths['watershed_tif']}")
 
     # Calculate watershed area
-    with rasterio.open(FILE_PATHS["watershed_tif"]) as src:
+    with rasterio.open(paths["watershed_tif"]) as src:
         ws = src.read(1)
-        watershed_area_m2 = np.sum(ws > 0) * CELL_AREA_M2
-    return True, float(watershed_area_m2)
+        watershed_area_m2 = (ws > 0).sum(axis=1) @ cell_areas_m2(src.transform, src.crs, src.height)
 
-def process_landcover():
-    """Process landcover to compute C-factor within the watershed."""
-    esa_path = os.path.abspath("merged_landcover.tif")
-    if not os.path.exists(esa_path):
-        logger.error("Landcover file 'merged_landcover.tif' not found")
-        raise FileNotFoundError("Landcover file 'merged_landcover.tif' not found")
-
-    with rasterio.open(FILE_PATHS["watershed_tif"]) as src_ws:
-        ws = src_ws.read(1)
-        ws_transform = src_ws.transform
-        ws_crs = src_ws.crs
-        ws_bounds = src_ws.bounds
-
-    with rasterio.open(esa_path) as src_lc:
-        if src_lc.crs != ws_crs:
-            logger.error("CRS mismatch between watershed and landcover")
-            raise RuntimeError("CRS mismatch: reproject landcover first")
-        window = from_bounds(
-            ws_bounds.left, ws_bounds.bottom, ws_bounds.right, ws_bounds.top,
-            transform=src_lc.transform
-        )
-        window = window.round_offsets().round_shape()
-        lc_window = src_lc.read(1, window=window)
-        lc_window_transform = src_lc.window_transform(window)
-        lc_meta = src_lc.meta.copy()
-
-    lc_meta.update({
-        "height": lc_window.shape[0],
-        "width": lc_window.shape[1],
-        "transform": lc_window_transform
-    })
-
-    C_window = np.full(lc_window.shape, np.nan, dtype=np.float32)
-    for cls, cval in C_LOOKUP.items():
-        C_window[lc_window == cls] = cval
+    # Publish downloadable products as COGs once WhiteboxTools no longer reads them
+    convert_to_cog(paths["filled_dem"], PREDICTOR="YES")
+    convert_to_cog(paths["streams"], "nearest")
+    return True, float(watershed_area_m2)
 
-    nan_mask = np.isnan(C_window)
-    if np.any(nan_mask):
-        mean_val = np.nanmean(C_window)
-        C_window[nan_mask] = mean_val
+def landcover_files():
+    """Landcover rasters with their modification times; tiles in LANDCOVER_DIR take precedence."""
+    files = []
+    if os.path.isdir(LANDCOVER_DIR):
+        files = [
+            os.path.join(LANDCOVER_DIR, name) for name in sorted(os.listdir(LANDCOVER_DIR))
+            if name.lower().endswith(LANDCOVER_EXTENSIONS)
+        ]
+    if os.path.exists(LANDCOVER_LEGACY_FILE):
+        files.append(LANDCOVER_LEGACY_FILE)
+    return tuple((path, os.stat(path).st_mtime_ns) for path in files)
+
+def landcover_signature():
+    """Short digest of the landcover sources, so cached C-factors follow dataset updates."""
+    return hashlib.sha1(json.dumps(landcover_files()).encode()).hexdigest()[:12]
+
+@functools.lru_cache(maxsize=4)
+def _landcover_index(files):
+    """STRtree over the lon/lat footprints of the landcover files."""
+    from shapely.geometry import box
+    from shapely.strtree import STRtree
+    footprints = []
+    for path, _ in files:
+        with rasterio.open(path) as src:
+            footprints.append(box(*transform_bounds(src.crs, "EPSG:4326", *src.bounds)))
+    return STRtree(footprints)
+
+def landcover_sources(west, south, east, north):
+    """Landcover files whose footprint intersects a lon/lat box, in precedence order."""
+    files = landcover_files()
+    if not files:
+        raise FileNotFoundError(f"No landcover data in '{LANDCOVER_DIR}' or '{LANDCOVER_LEGACY_FILE}'")
+    from shapely.geometry import box
+    hits = _landcover_index(files).query(box(west, south, east, north))
+    return [files[i][0] for i in sorted(hits)]
+
+def iter_landcover_blocks(profile, bounds):
+    """Yield (window, class codes) row blocks of the landcover warped onto a raster's grid.
+
+    Sources are read in precedence order; cells no source covers and classes
+    outside the 256-entry LUT come out as 0 (unknown).
+    """
+    sources = landcover_sources(*transform_bounds(profile["crs"], "EPSG:4326", *bounds))
+    if not sources:
+        logger.error("No landcover source covers the watershed")
+        raise FileNotFoundError("No landcover source covers the watershed")
+    logger.info(f"Landcover sources: {', '.join(os.path.basename(p) for p in sources)}")
+
+    height, width = profile["height"], profile["width"]
+    with ExitStack() as stack:
+        vrts = [
+            stack.enter_context(WarpedVRT(
+                stack.enter_context(rasterio.open(path)), crs=profile["crs"],
+                transform=profile["transform"], width=width, height=height,
+                resampling=Resampling.mode, nodata=0
+            ))
+            for path in sources
+        ]
+        for window, _, _ in iter_windows(height, width):
+            block = np.zeros((window.height, width), dtype=np.uint8)
+            for vrt in vrts:
+                missing = block == 0
+                if not missing.any():
+                    break
+                lc = vrt.read(1, window=window)
+                block[missing] = np.where((lc > 0) & (lc < 256), lc, 0)[missing]
+            yield window, block
+
+def c_factor_lut(class_counts):
+    """C_LUT with unknown classes set to the mean C of the known classes counted in the bbox."""
+    known = ~np.isnan(C_LUT)
+    if not class_counts[known].any():
+        raise RuntimeError("No landcover class with a known C-factor inside the bounding box")
+    mean_val = np.sum(class_counts[known] * C_LUT[known], dtype=np.float64) / class_counts[known].sum()
+    if class_counts[~known].any():
         logger.info(f"Filled NaN values with mean C-factor: {mean_val:.2f}")
-
-    with rasterio.open(FILE_PATHS["watershed_tif"]) as src_ws:
-        ws_mask = src_ws.read(1, window=window)
-    C_window[ws_mask == 0] = np.nan
-
-    plt.figure(figsize=(10, 6))
-    plt.title("Landcover C-factor")
-    plt.imshow(C_window, cmap="RdYlGn")
-    plt.colorbar(label="C-factor")
-    plt.savefig(FILE_PATHS["landcover_c_factor_png"], dpi=300, bbox_inches='tight')
-    plt.close()
-
-    rows, cols = np.where(~np.isnan(C_window))
-    values = C_window[rows, cols]
-    mean_c_factor = np.mean(values)
+    return np.where(known, C_LUT, mean_val).astype(np.float32)
+
+def process_landcover(paths=FILE_PATHS):
+    """Process landcover to compute C-factor within the watershed.
+
+    Landcover sources are warped onto the watershed grid and read in row blocks.
+    Classes without a C-factor take the mean C of the known classes in the
+    bounding box, then the mean is taken over the watershed cells.
+    """
+    with rasterio.open(paths["watershed_tif"]) as src_ws:
+        ws = src_ws.read(1) > 0
+        ws_profile = src_ws.profile
+        ws_bounds = src_ws.bounds
+    ws_rows = np.flatnonzero(ws.any(axis=1))
+    ws_cols = np.flatnonzero(ws.any(axis=0))
+    if ws_rows.size == 0:
+        raise RuntimeError("Watershed raster contains no cells")
+    crop = Window(ws_cols[0], ws_rows[0], ws_cols[-1] - ws_cols[0] + 1, ws_rows[-1] - ws_rows[0] + 1)
+
+    # One pass over the bbox: class histograms for the means, class codes kept for the watershed crop
+    hist_bbox = np.zeros(256, dtype=np.int64)
+    hist_ws = np.zeros(256, dtype=np.int64)
+    codes = np.zeros((crop.height, crop.width), dtype=np.uint8)
+    for window, block in iter_landcover_blocks(ws_profile, ws_bounds):
+        row_off = window.row_off
+        hist_bbox += np.bincount(block.ravel(), minlength=256)
+        hist_ws += np.bincount(block[ws[window.toslices()]], minlength=256)
+
+        top = max(row_off, crop.row_off)
+        bottom = min(row_off + window.height, crop.row_off + crop.height)
+        if top < bottom:
+            codes[top - crop.row_off:bottom - crop.row_off] = \
+                block[top - row_off:bottom - row_off, crop.col_off:crop.col_off + crop.width]
+
+    lut = c_factor_lut(hist_bbox)
+    mean_c_factor = np.sum(hist_ws * lut, dtype=np.float64) / hist_ws.sum()
     logger.info(f"Mean C-factor: {mean_c_factor:.2f}")
 
-    with rasterio.open(FILE_PATHS["c_factor_tif"], "w", **lc_meta) as dst:
-        dst.write(C_window, 1)
-    logger.info(f"C-factor raster saved: {FILE_PATHS['c_factor_tif']}")
+    c_profile = ws_profile.copy()
+    c_profile.update(
+        dtype="float32", count=1, nodata=np.nan, height=crop.height, width=crop.width,
+        transform=window_transform(crop, ws_profile["transform"])
+    )
+    ws_crop = ws[crop.toslices()]
+    with cog_writer(paths["c_factor_tif"], c_profile, PREDICTOR="YES") as dst:
+        for window, _, _ in iter_windows(crop.height, crop.width):
+            rows, _ = window.toslices()
+            C_block = np.where(ws_crop[rows], lut[codes[rows]], np.nan).astype(np.float32)
+            dst.write(C_block, 1, window=window)
+    logger.info(f"C-factor raster saved: {paths['c_factor_tif']}")
 
     return float(mean_c_factor)
 
+def basin_c_factors(paths, n_basins):
+    """Mean C-factor of every labelled sub-basin, from one pass over the landcover."""
+    with rasterio.open(paths["basins_tif"]) as src:
+        labels = src.read(1)
+        profile = src.profile
+        bounds = src.bounds
+    counts = np.zeros((n_basins + 1) * 256, dtype=np.int64)
+    for window, block in iter_landcover_blocks(profile, bounds):
+        keys = labels[window.toslices()].astype(np.int64) * 256 + block
+        counts += np.bincount(keys.ravel(), minlength=counts.size)
+    counts = counts.reshape(n_basins + 1, 256)
+    lut = c_factor_lut(counts.sum(axis=0))
+    return (counts[1:] @ lut.astype(np.float64)) / counts[1:].sum(axis=1)
+
 def calculate_peak_runoff(watershed_area_m2, rainfall_intensity_inch_per_hour, mean_c_factor):
     """Calculate peak runoff Q (cubic feet per second) using Q = CIA."""
     watershed_area_acres = watershed_area_m2 * 0.000247105
@@ -293,194 +1533,1510 @@ def calculate_peak_runoff(watershed_area_m2, rainfall_intensity_inch_per_hour, m
                 f"I={rainfall_intensity_inch_per_hour:.2f} inch/hr, A={watershed_area_acres:.2f} acres)")
     return float(Q_feet3_s)
 
-def calculate_flood_depth(Q_feet3_s, flood_h):
-    """Calculate flood depth and inundation mask."""
-    with rasterio.open(FILE_PATHS["filled_dem"]) as src:
-        dem = src.read(1)
-        transform = src.transform
+def runoff_volume_m3(Q_feet3_s, flood_h):
+    """Runoff volume (m³) of a peak flow Q (ft³/s) held for flood_h hours."""
+    return Q_feet3_s * flood_h * 3600 * 0.0283168  # Convert ft³ to m³
+
+class StageVolumeCurve:
+    """Stage–volume (hypsometric) curve of a DEM for level-pool flood filling.
+
+    Elevations are sorted once; the stored volume below every sorted elevation
+    is precomputed so the water level for any volume is found by binary search.
+    cell_area_m2 is a scalar or one area per cell. The curve keeps four float64
+    values per valid cell; cumulative sums are taken in place to stay close to that.
+    """
+
+    def __init__(self, dem, cell_area_m2):
+        dem = np.asarray(dem, dtype=np.float64)
+        areas = np.broadcast_to(np.asarray(cell_area_m2, dtype=np.float64), dem.shape)
+        valid = ~np.isnan(dem)
+        if not np.any(valid):
+            raise ValueError("DEM has no valid cells to flood")
+        if valid.all():  # flood domains are already compressed to valid cells
+            elevations, areas = dem.ravel(), areas.ravel()
+        else:
+            elevations, areas = dem[valid], areas[valid]
+        order = np.argsort(elevations, kind="stable")
+        self.elevations = elevations[order]
+        self.cum_area = areas[order]
+        del order
+        self.cum_area_elev = self.cum_area * self.elevations
+        np.cumsum(self.cum_area, out=self.cum_area)
+        np.cumsum(self.cum_area_elev, out=self.cum_area_elev)
+        # Volume held below the water surface when it sits at each sorted elevation
+        self.volumes = self.elevations * self.cum_area
+        self.volumes -= self.cum_area_elev
+
+    def stage_for_volume(self, volume_m3):
+        """Water surface elevation (m) that stores the given volume(s) in m³."""
+        volume_m3 = np.maximum(np.asarray(volume_m3, dtype=np.float64), 0.0)
+        k = np.searchsorted(self.volumes, volume_m3, side="right")
+        k = np.clip(k, 1, self.elevations.size) - 1
+        return (volume_m3 + self.cum_area_elev[k]) / self.cum_area[k]
+
+    def volume_at_stage(self, stage_m):
+        """Volume (m³) stored below the given water surface elevation(s)."""
+        stage_m = np.asarray(stage_m, dtype=np.float64)
+        k = np.searchsorted(self.elevations, stage_m, side="right")
+        wet = k > 0
+        k = np.maximum(k, 1) - 1
+        return np.where(wet, stage_m * self.cum_area[k] - self.cum_area_elev[k], 0.0)
+
+    def flooded_area_at_stage(self, stage_m):
+        """Area (m²) of cells lying strictly below the given water surface elevation(s)."""
+        k = np.searchsorted(self.elevations, np.asarray(stage_m, dtype=np.float64), side="left")
+        return np.where(k > 0, self.cum_area[np.maximum(k, 1) - 1], 0.0)
+
+    @staticmethod
+    def depth(dem, stage_m):
+        """Flood depth grid (m) for a water surface elevation over the DEM."""
+        depth = stage_m - np.asarray(dem, dtype=np.float64)
+        np.maximum(depth, 0, out=depth)
+        np.nan_to_num(depth, copy=False, nan=0)
+        return depth.astype(np.float32)
+
+def load_flood_domain(paths, extent=None, buffer_cells=0):
+    """Load the cells eligible for flooding as a compressed 1-D elevation vector.
+
+    With extent "watershed" only cells inside the delineated watershed (grown
+    by buffer_cells) are kept and the DEM is read only within the mask's
+    bounding window. Returns (elevations, cell areas, domain mask, window, profile).
+    """
+    extent = extent or FLOOD_EXTENT
+    with rasterio.open(paths["filled_dem"]) as src:
         profile = src.profile
         nodata = src.nodata if src.nodata is not None else -9999
-        dem = np.where(dem == nodata, np.nan, dem)
-
-    V_total_m3 = Q_feet3_s * flood_h * 3600 * 0.0283168  # Convert ft³ to m³
-    water_depth = np.zeros_like(dem, dtype=np.float32)
-    remaining_volume = V_total_m3
-
-    while remaining_volume > 0:
-        min_elevation = np.nanmin(dem + water_depth)
-        flood_cells = (dem + water_depth == min_elevation)
-        num_flood_cells = np.sum(flood_cells)
-        volume_per_meter = num_flood_cells * CELL_AREA_M2
-
-        if remaining_volume >= volume_per_meter:
-            water_depth[flood_cells] += 1
-            remaining_volume -= volume_per_meter
+        if extent == "watershed":
+            with rasterio.open(paths["watershed_tif"]) as src_ws:
+                ws = src_ws.read(1) > 0
+            if buffer_cells > 0:
+                from scipy.ndimage import binary_dilation
+                ws = binary_dilation(ws, iterations=int(buffer_cells))
+            rows = np.flatnonzero(ws.any(axis=1))
+            cols = np.flatnonzero(ws.any(axis=0))
+            if rows.size == 0:
+                raise ValueError("Watershed mask is empty")
+            window = Window(cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1)
+            dem = src.read(1, window=window)
+            domain = ws[window.toslices()]
+        elif extent == "bbox":
+            window = Window(0, 0, src.width, src.height)
+            dem = src.read(1)
+            domain = np.ones(dem.shape, dtype=bool)
         else:
-            water_depth[flood_cells] += remaining_volume / volume_per_meter
-            remaining_volume = 0
+            raise ValueError(f"Unknown flood extent '{extent}'")
+    domain &= (dem != nodata) & ~np.isnan(dem)
+    logger.info(f"Flood domain ({extent}): {int(domain.sum())} cells in a "
+                f"{window.height}×{window.width} window")
+    row_areas = cell_areas_m2(window_transform(window, profile["transform"]), profile["crs"], window.height)
+    areas = np.broadcast_to(row_areas[:, None], domain.shape)[domain]
+    return dem[domain].astype(np.float64), areas, domain, window, profile
+
+def _scatter_window(domain, values):
+    """Expand a compressed per-cell vector back to its window (0 outside the domain)."""
+    grid = np.zeros(domain.shape, dtype=values.dtype)
+    grid[domain] = values
+    return grid
+
+def write_domain_values(dst, band, values, domain, window):
+    """Write a compressed per-cell vector into window of dst, one row block at a time."""
+    row_offsets = np.concatenate(([0], np.cumsum(domain.sum(axis=1))))
+    for block, _, _ in iter_windows(*domain.shape):
+        rows, _ = block.toslices()
+        grid = _scatter_window(domain[rows], values[row_offsets[rows.start]:row_offsets[rows.stop]])
+        dst.write(grid, band, window=Window(
+            window.col_off + block.col_off, window.row_off + block.row_off, block.width, block.height
+        ))
+
+def calculate_flood_depth(Q_feet3_s, flood_h, paths=FILE_PATHS, extent=None, buffer_cells=0):
+    """Calculate flood depth and inundation mask."""
+    elevations, areas, domain, window, profile = load_flood_domain(paths, extent, buffer_cells)
 
-    flood_depth = water_depth
-    inundation_mask = (flood_depth > 0).astype(np.uint8)
+    V_total_m3 = runoff_volume_m3(Q_feet3_s, flood_h)
+    curve = StageVolumeCurve(elevations, areas)
+    water_level = float(curve.stage_for_volume(V_total_m3))
+    flooded_area_m2 = float(curve.flooded_area_at_stage(water_level))
+    flooded_volume_m3 = float(curve.volume_at_stage(water_level))
+    logger.info(f"Water surface elevation: {water_level:.2f} m")
+    del curve, areas
 
+    depth_cells = StageVolumeCurve.depth(elevations, water_level)
+    del elevations
+
+    # Cells outside the window are never written and read back as nodata
     flood_depth_profile = profile.copy()
     flood_depth_profile.update(dtype="float32", count=1, nodata=np.nan)
-    with rasterio.open(FILE_PATHS["flood_depth"], "w", **flood_depth_profile) as dst:
-        dst.write(flood_depth, 1)
+    with cog_writer(paths["flood_depth"], flood_depth_profile, PREDICTOR="YES") as dst:
+        write_domain_values(dst, 1, depth_cells, domain, window)
 
     inundation_profile = profile.copy()
     inundation_profile.update(dtype="uint8", count=1, nodata=0)
-    with rasterio.open(FILE_PATHS["inundation_mask"], "w", **inundation_profile) as dst:
-        dst.write(inundation_mask, 1)
-
-    plt.figure(figsize=(10, 8))
-    plt.imshow(flood_depth, cmap="Blues", extent=(
-        transform[2], transform[2] + dem.shape[1] * transform[0],
-        transform[5] + dem.shape[0] * transform[4], transform[5]
-    ))
-    plt.colorbar(label="Flood Depth (m)")
-    plt.title("Flood Depth Map")
-    plt.xlabel("Longitude")
-    plt.ylabel("Latitude")
-    plt.tight_layout()
-    plt.savefig(FILE_PATHS["flood_depth_png"], dpi=300, bbox_inches='tight')
-    plt.close()
-
-    logger.info(f"Flood depth saved: {FILE_PATHS['flood_depth']}")
-    logger.info(f"Inundation mask saved: {FILE_PATHS['inundation_mask']}")
-    logger.info(f"Flood depth map saved: {FILE_PATHS['flood_depth_png']}")
-
-    flooded_area_m2 = np.sum(inundation_mask) * CELL_AREA_M2
+    with cog_writer(paths["inundation_mask"], inundation_profile, "nearest", NBITS=1) as dst:
+        write_domain_values(dst, 1, (depth_cells > 0).astype(np.uint8), domain, window)
+
+    logger.info(f"Flood depth saved: {paths['flood_depth']}")
+    logger.info(f"Inundation mask saved: {paths['inundation_mask']}")
+
     flooded_area_km2 = flooded_area_m2 / 1e6
-    flooded_volume_m3 = np.nansum(flood_depth * CELL_AREA_M2)
     logger.info(f"Total Flooded Area: {flooded_area_km2:.2f} km²")
     logger.info(f"Total Flooded Volume: {flooded_volume_m3:.2f} m³")
 
     return float(flooded_area_km2), float(flooded_volume_m3)
 
-def create_3d_visualization():
-    """Create a 3D visualization using PyVista."""
-    pv.set_jupyter_backend('trame')
-    with rasterio.open(FILE_PATHS["filled_dem"]) as src:
+def _fill_basin(elevations, areas, volume_m3):
+    """Water level, flooded area and stored volume of one basin holding volume_m3."""
+    curve = StageVolumeCurve(elevations, areas)
+    water_level = float(curve.stage_for_volume(volume_m3))
+    return water_level, float(curve.flooded_area_at_stage(water_level)), float(curve.volume_at_stage(water_level))
+
+_basin_executor = None
+_basin_executor_lock = threading.Lock()
+
+def _get_basin_executor():
+    """Lazily create the process pool that fills sub-basins in parallel."""
+    global _basin_executor
+    with _basin_executor_lock:
+        if _basin_executor is None:
+            _basin_executor = ProcessPoolExecutor(
+                max_workers=BASIN_WORKERS,
+                mp_context=multiprocessing.get_context(JOB_START_METHOD)
+            )
+    return _basin_executor
+
+def calculate_basin_flood_depth(basins, flood_h, paths=FILE_PATHS):
+    """Fill every sub-basin with its own runoff volume and mosaic the flood depths.
+
+    Each basin gets its own stage–volume curve, solved across a process pool.
+    Cells outside every basin are nodata. Adds the per-basin results to basins.
+    """
+    with rasterio.open(paths["basins_tif"]) as src:
+        labels = src.read(1)
+    with rasterio.open(paths["filled_dem"]) as src:
+        dem = src.read(1).astype(np.float64)
+        profile = src.profile
+        nodata = src.nodata if src.nodata is not None else -9999
+    dem[dem == nodata] = np.nan
+    labels[np.isnan(dem)] = 0
+    row_areas = cell_areas_m2(profile["transform"], profile["crs"], dem.shape[0])
+
+    # Group the cells of each basin into one elevation vector
+    cells = np.flatnonzero(labels)
+    cells = cells[np.argsort(labels.ravel()[cells], kind="stable")]
+    counts = np.bincount(labels.ravel()[cells], minlength=len(basins) + 1)[1:]
+    splits = np.cumsum(counts)[:-1]
+    elevations = np.split(dem.ravel()[cells], splits)
+    areas = np.split(row_areas[cells // dem.shape[1]], splits)
+    volumes = [runoff_volume_m3(b["peak_runoff_cfs"], flood_h) for b in basins]
+
+    if BASIN_WORKERS > 1 and len(basins) > 1:
+        results = list(_get_basin_executor().map(_fill_basin, elevations, areas, volumes))
+    else:
+        results = list(map(_fill_basin, elevations, areas, volumes))
+
+    water_levels = np.full(len(basins) + 1, np.nan)
+    for basin, (water_level, area_m2, volume_m3) in zip(basins, results):
+        water_levels[basin["basin_id"]] = water_level
+        basin.update(water_level_m=water_level, flooded_area_m2=area_m2, flooded_volume_m3=volume_m3)
+
+    depth_profile = dict(profile, dtype="float32", count=1, nodata=np.nan)
+    mask_profile = dict(profile, dtype="uint8", count=1, nodata=0)
+    with cog_writer(paths["flood_depth"], depth_profile, PREDICTOR="YES") as dst_depth, \
+            cog_writer(paths["inundation_mask"], mask_profile, "nearest", NBITS=1) as dst_mask:
+        for window, _, _ in iter_windows(*dem.shape):
+            rows, _ = window.toslices()
+            block_labels = labels[rows]
+            depth = np.where(
+                block_labels > 0, np.maximum(water_levels[block_labels] - dem[rows], 0), np.nan
+            ).astype(np.float32)
+            dst_depth.write(depth, 1, window=window)
+            dst_mask.write((depth > 0).astype(np.uint8), 1, window=window)
+    logger.info(f"Sub-basin flood depth mosaic saved: {paths['flood_depth']}")
+
+    return sum(area for _, area, _ in results) / 1e6, sum(volume for _, _, volume in results)
+
+def calculate_flood_depth_batch(scenarios, paths=FILE_PATHS, extent=None, buffer_cells=0):
+    """Flood depth for many (Q, duration) scenarios as one multi-band raster.
+
+    The stage–volume curve is built once and solved for every scenario volume
+    in a single vectorized call; each scenario becomes one band.
+    """
+    elevations, areas, domain, window, profile = load_flood_domain(paths, extent, buffer_cells)
+
+    Q_feet3_s = np.array([s["peak_runoff_cfs"] for s in scenarios], dtype=np.float64)
+    flood_h = np.array([s["duration"] for s in scenarios], dtype=np.float64)
+    V_total_m3 = runoff_volume_m3(Q_feet3_s, flood_h)
+
+    curve = StageVolumeCurve(elevations, areas)
+    water_levels = curve.stage_for_volume(V_total_m3)
+    flooded_areas_m2 = curve.flooded_area_at_stage(water_levels)
+    flooded_volumes_m3 = curve.volume_at_stage(water_levels)
+
+    batch_profile = profile.copy()
+    batch_profile.update(dtype="float32", count=len(scenarios), nodata=np.nan)
+    with cog_writer(paths["flood_depth_batch"], batch_profile, PREDICTOR="YES") as dst:
+        for band, (scenario, water_level) in enumerate(zip(scenarios, water_levels), start=1):
+            write_domain_values(dst, band, curve.depth(elevations, water_level), domain, window)
+            dst.set_band_description(
+                band, f"I={scenario['rainfall_intensity']:g} in/hr, duration={scenario['duration']:g} h"
+            )
+    logger.info(f"Batch flood depth saved: {paths['flood_depth_batch']} ({len(scenarios)} bands)")
+
+    results = []
+    for band, (water_level, area_m2, volume_m3) in enumerate(
+            zip(water_levels, flooded_areas_m2, flooded_volumes_m3), start=1):
+        results.append({
+            "band": band,
+            "water_level_m": float(round(water_level, 2)),
+            "flooded_area_km2": float(round(area_m2 / 1e6, 2)),
+            "flooded_volume_m3": float(round(volume_m3, 2))
+        })
+    return results
+
+def storm_rainfall(hyetograph, hyetograph_step_min, time_step_min, n_steps):
+    """Rainfall depth (m) in each routing time step.
+
+    hyetograph holds intensities (inches/hour), each lasting hyetograph_step_min;
+    the cumulative rainfall curve is resampled onto the routing steps, so no
+    rain is lost when the two step lengths differ.
+    """
+    hyetograph = np.asarray(hyetograph, dtype=np.float64)
+    edges_min = np.arange(hyetograph.size + 1) * hyetograph_step_min
+    cumulative_m = np.concatenate(([0.0], np.cumsum(hyetograph * 0.0254 * hyetograph_step_min / 60)))
+    return np.diff(np.interp(np.arange(n_steps + 1) * time_step_min, edges_min, cumulative_m))
+
+def _routing_network(paths, window, domain):
+    """Receiver, flow length (m) and channel flag of every domain cell, in domain order.
+
+    Receivers index the compressed domain vector; -1 means the flow leaves the domain.
+    """
+    with rasterio.open(paths["flow_dir"]) as src:
+        pointer = src.read(1, window=window)
+        transform, crs = window_transform(window, src.transform), src.crs
+        if src.nodata is not None:
+            pointer = np.where(pointer == src.nodata, 0, pointer)
+    with rasterio.open(paths["streams"]) as src:
+        channel = src.read(1, window=window, masked=True).filled(0)[domain] > 0
+    pointer = np.where(domain, pointer, 0).astype(np.int16)
+
+    receiver = d8_receivers(pointer)[domain.ravel()]
+    cell_index = np.full(domain.size, -1, dtype=receiver.dtype)
+    cell_index[np.flatnonzero(domain)] = np.arange(int(domain.sum()), dtype=receiver.dtype)
+    receiver = np.where(receiver >= 0, cell_index[receiver], -1)
+    del cell_index
+
+    size_x, size_y = cell_sizes_m(transform, crs, domain.shape[0])
+    rows = np.broadcast_to(np.arange(domain.shape[0], dtype=np.int32)[:, None], domain.shape)[domain]
+    codes = pointer[domain]
+    del pointer
+    length = size_x[rows].astype(np.float32)  # outlets: one cell width
+    for dr, dc, code in D8_DIRECTIONS:
+        cells = codes == code
+        length[cells] = np.hypot(dc * size_x[rows[cells]], dr * size_y[rows[cells]])
+    return receiver, length, channel
+
+def route_hydrograph(rainfall_m, time_step_min, mean_c_factor, paths=FILE_PATHS, snapshot_interval_min=None):
+    """Route rainfall excess through the watershed as a cascade of linear reservoirs on the D8 network.
+
+    Every cell stores water and releases it downstream with the exact
+    linear-reservoir solution for one time step, k = 1 - exp(-dt·v/L), where v
+    is the channel or hillslope velocity and L the flow length to the receiver.
+    Within a step cells are updated level by level in topological order, so each
+    level is a handful of vectorized operations. Writes depth snapshots (one band
+    per snapshot_interval_min) to flood_depth_series, the peak depth to
+    flood_depth and the inundation mask; returns the outlet hydrograph and totals.
+
+    Per-cell coefficients are float32 and temporaries are freed as soon as they
+    are used; only the storage and inflow accumulators stay float64, so the
+    volume balance holds over long storms.
+    """
+    snapshot_interval_min = snapshot_interval_min or ROUTING_SNAPSHOT_MIN
+    areas, domain, window, profile = load_flood_domain(paths, "watershed")[1:]
+    receiver, length, channel = _routing_network(paths, window, domain)
+    with rasterio.open(paths["c_factor_tif"]) as src:
+        c_window = from_bounds(*window_bounds(window, profile["transform"]), transform=src.transform).round_offsets().round_lengths()
+        c_factor = src.read(1, window=c_window, boundless=True, fill_value=np.nan)[domain]
+    c_factor = np.where(np.isfinite(c_factor), c_factor, mean_c_factor).astype(np.float32)
+
+    dt_s = time_step_min * 60
+    a = np.where(channel, ROUTING_CHANNEL_VELOCITY_MS * dt_s, ROUTING_HILLSLOPE_VELOCITY_MS * dt_s).astype(np.float32)
+    a /= length
+    del channel, length
+    release = -np.expm1(-a)  # share of the stored volume released per step
+    pass_through = 1 - release / a  # share of this step's inflow released within the step
+    del a
+
+    # Reorder every per-cell array by topological level so each level is a contiguous slice;
+    # flow leaving the domain goes to an extra sink slot at index n
+    levels = d8_topological_levels(receiver)
+    level_bounds = np.concatenate(([0], np.cumsum([level.size for level in levels])))
+    level_slices = [slice(start, stop) for start, stop in zip(level_bounds[:-1], level_bounds[1:])]
+    order = np.concatenate(levels)
+    del levels
+    position = np.empty_like(order)
+    position[order] = np.arange(order.size, dtype=order.dtype)
+    n = order.size
+    downstream = receiver[order]
+    del receiver
+    downstream = np.where(downstream >= 0, position[downstream], n).astype(position.dtype)
+    release, pass_through = release[order], pass_through[order]
+    cell_area = areas[order].astype(np.float32)
+    runoff_area = c_factor[order] * cell_area
+    del areas, c_factor, order
+    logger.info(f"Routing {n} cells in {len(level_slices)} levels over {rainfall_m.size} steps of {time_step_min:g} min")
+
+    steps_per_snapshot = max(1, int(round(snapshot_interval_min / time_step_min)))
+    snapshot_steps = set(range(steps_per_snapshot - 1, rainfall_m.size, steps_per_snapshot)) | {rainfall_m.size - 1}
+    series_profile = profile.copy()
+    series_profile.update(dtype="float32", count=len(snapshot_steps), nodata=np.nan)
+
+    storage = np.zeros(n)
+    inflow = np.zeros(n + 1)
+    depth = np.empty(n, dtype=np.float32)
+    peak_depth = np.zeros(n, dtype=np.float32)
+    outflow_cms = np.zeros(rainfall_m.size)
+    stored_m3 = np.zeros(rainfall_m.size)
+    band = 0
+    with cog_writer(paths["flood_depth_series"], series_profile, PREDICTOR="YES") as dst:
+        for step, rain_m in enumerate(rainfall_m):
+            np.multiply(runoff_area, rain_m, out=inflow[:n])
+            inflow[n] = 0.0
+            for level in level_slices:
+                volume_in = inflow[level]
+                volume_out = release[level] * storage[level] + pass_through[level] * volume_in
+                storage[level] += volume_in - volume_out
+                np.add.at(inflow, downstream[level], volume_out)
+            outflow_cms[step] = inflow[n] / dt_s
+            stored_m3[step] = storage.sum()
+            np.divide(storage, cell_area, out=depth, casting="same_kind")
+            np.maximum(peak_depth, depth, out=peak_depth)
+            if step in snapshot_steps:
+                band += 1
+                write_domain_values(dst, band, depth[position], domain, window)
+                dst.set_band_description(band, f"t={(step + 1) * time_step_min:g} min")
+    logger.info(f"Flood depth series saved: {paths['flood_depth_series']} ({band} bands)")
+
+    flooded_area_m2 = float(cell_area.sum(where=peak_depth >= ROUTING_WET_DEPTH_M, dtype=np.float64))
+    peak_depth = peak_depth[position]
+    depth_profile = profile.copy()
+    depth_profile.update(dtype="float32", count=1, nodata=np.nan)
+    with cog_writer(paths["flood_depth"], depth_profile, PREDICTOR="YES") as dst:
+        write_domain_values(dst, 1, peak_depth, domain, window)
+    wet = peak_depth >= ROUTING_WET_DEPTH_M
+    inundation_profile = profile.copy()
+    inundation_profile.update(dtype="uint8", count=1, nodata=0)
+    with cog_writer(paths["inundation_mask"], inundation_profile, "nearest", NBITS=1) as dst:
+        write_domain_values(dst, 1, wet.astype(np.uint8), domain, window)
+
+    peak_step = int(np.argmax(outflow_cms))
+    excess_m3 = float(np.sum(rainfall_m) * runoff_area.sum(dtype=np.float64))
+    logger.info(f"Peak outflow {outflow_cms[peak_step]:.2f} m³/s at {(peak_step + 1) * time_step_min:g} min")
+    return {
+        "flooded_area_km2": flooded_area_m2 / 1e6,
+        "flooded_volume_m3": float(stored_m3.max()),
+        "hydrograph": {
+            "time_step_min": float(time_step_min),
+            "time_min": [float((i + 1) * time_step_min) for i in range(rainfall_m.size)],
+            "rainfall_mm": [float(round(r * 1000, 3)) for r in rainfall_m],
+            "outflow_cms": [float(round(q, 3)) for q in outflow_cms],
+            "peak_outflow_cms": float(round(outflow_cms[peak_step], 3)),
+            "time_to_peak_min": float((peak_step + 1) * time_step_min),
+            "rainfall_excess_m3": float(round(excess_m3, 2)),
+            "outflow_volume_m3": float(round(outflow_cms.sum() * dt_s, 2)),
+            "stored_volume_m3": float(round(stored_m3[-1], 2))
+        }
+    }
+
+def _lod_stride(shape, max_triangles):
+    """Smallest sampling stride that keeps a triangulated grid within max_triangles."""
+    rows, cols = shape
+    stride = 1
+    while 2 * (math.ceil(rows / stride) - 1) * (math.ceil(cols / stride) - 1) > max_triangles:
+        stride += 1
+    return stride
+
+def _build_full_scene(dem, flood_depth):
+    """Full-resolution terrain grid plus one point per flooded cell."""
+    pv = _get_pyvista()
+    rows, cols = dem.shape
+    x, y = np.meshgrid(np.arange(cols), np.arange(rows))
+    grid = pv.StructuredGrid(x, y, dem)
+    flooded_elevation = np.where(flood_depth > 0, dem + flood_depth, np.nan)
+    # StructuredGrid points are stored in Fortran order
+    grid["Flood Depth"] = np.nan_to_num(flood_depth, nan=0).ravel(order="F")
+    grid["Flooded Elevation"] = np.nan_to_num(flooded_elevation, nan=dem).ravel(order="F")
+
+    plotter = pv.Plotter(off_screen=True)
+    plotter.add_mesh(grid, scalars="Flooded Elevation", cmap="terrain", opacity=0.8, show_edges=False)
+    flood_mask = flood_depth > 0
+    flood_points = np.column_stack((x[flood_mask], y[flood_mask], flooded_elevation[flood_mask]))
+    flood_cloud = pv.PolyData(flood_points)
+    if flood_mask.any():  # PyVista cannot plot an empty mesh
+        plotter.add_mesh(flood_cloud, color="blue", point_size=5, render_points_as_spheres=True, label="Flooded Areas")
+    return plotter, grid.extract_surface(), flood_cloud
+
+def _build_lod_scene(dem, flood_depth, target_triangles):
+    """Downsampled terrain plus the flood as one decimated surface, within a triangle budget."""
+    pv = _get_pyvista()
+    terrain_budget = int(target_triangles * 0.75)
+    flood_budget = target_triangles - terrain_budget
+    stride = _lod_stride(dem.shape, terrain_budget)
+    dem_lod = dem[::stride, ::stride]
+    depth_lod = np.nan_to_num(flood_depth[::stride, ::stride], nan=0)
+    x, y = np.meshgrid(np.arange(dem.shape[1])[::stride], np.arange(dem.shape[0])[::stride])
+
+    terrain = pv.StructuredGrid(x, y, dem_lod)
+    terrain["Elevation"] = dem_lod.ravel(order="F")
+    terrain = terrain.extract_surface()
+
+    water = pv.StructuredGrid(x, y, np.where(depth_lod > 0, dem_lod + depth_lod, dem_lod))
+    water["Flood Depth"] = depth_lod.ravel(order="F")
+    flood_surface = water.threshold(1e-6, scalars="Flood Depth", method="upper")
+    flood_surface = flood_surface.extract_surface().triangulate()
+    if flood_surface.n_cells > flood_budget:
+        flood_surface = flood_surface.decimate(1 - flood_budget / flood_surface.n_cells)
+    logger.info(f"LOD scene: stride {stride}, {terrain.n_cells} terrain cells, "
+                f"{flood_surface.n_cells} flood triangles")
+
+    plotter = pv.Plotter(off_screen=True)
+    plotter.add_mesh(terrain, scalars="Elevation", cmap="terrain", opacity=0.8, show_edges=False)
+    if flood_surface.n_cells:
+        plotter.add_mesh(flood_surface, color="blue", opacity=0.7, label="Flooded Areas")
+    return plotter, terrain, flood_surface
+
+def create_3d_visualization(paths=FILE_PATHS, mode=None, target_triangles=None, formats=("html",)):
+    """Create a 3D visualization using PyVista.
+
+    "lod" mode keeps the scene within target_triangles; "full" draws every
+    DEM cell. Returns the FILE_PATHS keys of the exported files.
+    """
+    mode = mode or VIZ_MODE
+    target_triangles = target_triangles or VIZ_TARGET_TRIANGLES
+    with rasterio.open(paths["filled_dem"]) as src:
         dem = src.read(1)
-        transform = src.transform
         nodata = src.nodata if src.nodata is not None else -9999
         dem = np.where(dem == nodata, np.nan, dem)
 
-    with rasterio.open(FILE_PATHS["flood_depth"]) as src:
+    with rasterio.open(paths["flood_depth"]) as src:
         flood_depth = src.read(1)
 
     if flood_depth.shape != dem.shape:
         scale_y = dem.shape[0] / flood_depth.shape[0]
         scale_x = dem.shape[1] / flood_depth.shape[1]
+        from scipy.ndimage import zoom
         flood_depth_resized = zoom(flood_depth, (scale_y, scale_x), order=1)
     else:
         flood_depth_resized = flood_depth
 
-    rows, cols = dem.shape
-    x = np.arange(cols)
-    y = np.arange(rows)
-    x, y = np.meshgrid(x, y)
-    z = dem
-
-    grid = pv.StructuredGrid(x, y, z)
-    flood_depth_flattened = flood_depth_resized.ravel()
-    flooded_elevation = np.where(flood_depth_resized > 0, dem + flood_depth_resized, np.nan)
-    grid["Flood Depth"] = np.nan_to_num(flood_depth_flattened, nan=0)
-    grid["Flooded Elevation"] = np.nan_to_num(flooded_elevation.ravel(), nan=dem.ravel())
-
-    plotter = pv.Plotter()
-    plotter.add_mesh(grid, scalars="Flooded Elevation", cmap="terrain", opacity=0.8, show_edges=False)
-    flood_mask = flood_depth_resized > 0
-    flood_points = np.column_stack((x[flood_mask], y[flood_mask], flooded_elevation[flood_mask]))
-    flood_cloud = pv.PolyData(flood_points)
-    plotter.add_mesh(flood_cloud, color="blue", point_size=5, render_points_as_spheres=True, label="Flooded Areas")
-    plotter.add_legend()
+    if mode == "lod":
+        plotter, terrain, flood = _build_lod_scene(dem, flood_depth_resized, target_triangles)
+    elif mode == "full":
+        plotter, terrain, flood = _build_full_scene(dem, flood_depth_resized)
+    else:
+        raise ValueError(f"Unknown visualization mode '{mode}'")
+    if flood.n_points:  # a dry scenario draws no flood mesh and has nothing to label
+        plotter.add_legend()
     plotter.add_axes()
     plotter.show_grid()
     plotter.set_background("white")
 
+    written = []
     try:
-        plotter.export_html(FILE_PATHS["flood_visualization"])
-        logger.info(f"3D visualization saved: {FILE_PATHS['flood_visualization']}")
+        if "html" in formats:
+            plotter.export_html(paths["flood_visualization"])
+            written.append("flood_visualization")
+        if "vtp" in formats:
+            terrain.save(paths["terrain_vtp"], binary=True)
+            flood.save(paths["flood_surface_vtp"], binary=True)
+            written += ["terrain_vtp", "flood_surface_vtp"]
+        if "gltf" in formats:
+            plotter.export_gltf(paths["flood_gltf"], inline_data=True)
+            written.append("flood_gltf")
+        for key in written:
+            logger.info(f"3D visualization saved: {paths[key]}")
     except Exception as e:
         logger.error(f"Failed to export 3D visualization: {str(e)}")
         raise
+    finally:
+        plotter.close()
+    return written
+
+_viz_executor = None
+_viz_executor_lock = threading.Lock()
+
+def _get_viz_executor():
+    """Lazily create the process pool that renders visualizations off the request thread."""
+    global _viz_executor
+    with _viz_executor_lock:
+        if _viz_executor is None:
+            _viz_executor = ProcessPoolExecutor(
+                max_workers=VIZ_WORKERS,
+                mp_context=multiprocessing.get_context(JOB_START_METHOD),
+                initializer=_get_pyvista
+            )
+    return _viz_executor
+
+def render_visualization(paths, mode, target_triangles, formats):
+    """Run create_3d_visualization where its exports work.
+
+    PyVista's HTML export (trame) only works on a process's main thread, so
+    requests served on worker threads (threaded servers, /process/stream) hand
+    HTML exports to a process pool. Job workers and other formats render inline.
+    """
+    if "html" not in formats or threading.current_thread() is threading.main_thread():
+        return create_3d_visualization(paths, mode, target_triangles, formats)
+    return _get_viz_executor().submit(create_3d_visualization, paths, mode, target_triangles, formats).result()
+
+def _new_figure(figsize):
+    _get_matplotlib()
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize)
+
+def _save_figure(fig, out_path):
+    """Save a figure through a temporary file so concurrent readers never see a partial PNG."""
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp.png"
+    fig.savefig(tmp_path, dpi=300, bbox_inches='tight')
+    os.replace(tmp_path, out_path)
+
+def render_dem_png(paths=FILE_PATHS):
+    """Static map of the downloaded DEM."""
+    with rasterio.open(paths["dem"]) as src:
+        arr = src.read(1)
+    fig = _new_figure((6, 5))
+    ax = fig.subplots()
+    from rasterio.plot import show
+    show(arr, ax=ax, cmap="terrain", title=f"DEM for User Box ({os.path.basename(paths['dem'])})")
+    fig.tight_layout()
+    _save_figure(fig, paths["dem_user_png"])
+
+def render_c_factor_png(paths=FILE_PATHS):
+    """Static map of the watershed C-factor."""
+    with rasterio.open(paths["c_factor_tif"]) as src:
+        C_window = src.read(1)
+    fig = _new_figure((10, 6))
+    ax = fig.subplots()
+    ax.set_title("Landcover C-factor")
+    im = ax.imshow(C_window, cmap="RdYlGn")
+    fig.colorbar(im, ax=ax, label="C-factor")
+    _save_figure(fig, paths["landcover_c_factor_png"])
+
+def render_flood_depth_png(paths=FILE_PATHS):
+    """Static map of the flood depth raster."""
+    with rasterio.open(paths["flood_depth"]) as src:
+        flood_depth = src.read(1)
+        bounds = src.bounds
+    fig = _new_figure((10, 8))
+    ax = fig.subplots()
+    im = ax.imshow(flood_depth, cmap="Blues", extent=(bounds.left, bounds.right, bounds.bottom, bounds.top))
+    fig.colorbar(im, ax=ax, label="Flood Depth (m)")
+    ax.set_title("Flood Depth Map")
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    fig.tight_layout()
+    _save_figure(fig, paths["flood_depth_png"])
+
+# Static PNG products, rendered from their source raster the first time they are downloaded
+PNG_RENDERERS = {
+    "dem_user_png": ("dem", render_dem_png),
+    "landcover_c_factor_png": ("c_factor_tif", render_c_factor_png),
+    "flood_depth_png": ("flood_depth", render_flood_depth_png),
+}
+
+def render_png(paths, key):
+    """Render a PNG product if it does not exist yet; returns False if its source is missing."""
+    if os.path.exists(paths[key]):
+        return True
+    source_key, renderer = PNG_RENDERERS[key]
+    if not os.path.exists(paths[source_key]):
+        return False
+    renderer(paths)
+    logger.info(f"Rendered on demand: {paths[key]}")
+    return True
+
+def tile_bounds(z, x, y):
+    """Web Mercator (EPSG:3857) bounds of an XYZ tile as (west, south, east, north)."""
+    half_world = math.pi * 6378137.0
+    size = 2 * half_world / 2 ** z
+    west = -half_world + x * size
+    north = half_world - y * size
+    return west, north - size, west + size, north
+
+@functools.lru_cache(maxsize=32)
+def colormap_lut(cmap_name):
+    """256-entry RGBA lookup table of a matplotlib colormap."""
+    return _get_matplotlib().colormaps[cmap_name](np.linspace(0, 1, 256), bytes=True)
+
+@functools.lru_cache(maxsize=256)
+def raster_value_range(path, mtime_ns):
+    """Approximate min and max of a raster's valid cells, cached per file version.
+
+    Only the smallest internal overview is read, which is plenty for a colour ramp.
+    """
+    with rasterio.open(path) as src:
+        overviews = src.overviews(1)
+    open_kwargs = {"overview_level": len(overviews) - 1} if overviews else {}
+    with rasterio.open(path, **open_kwargs) as src:
+        data = src.read(1, masked=True).astype(np.float64).filled(np.nan)
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    return float(finite.min()), float(finite.max())
+
+def encode_png(rgba):
+    _get_matplotlib()
+    from matplotlib.image import imsave
+    buf = io.BytesIO()
+    imsave(buf, rgba, format="png")
+    return buf.getvalue()
+
+@functools.lru_cache(maxsize=1)
+def empty_tile():
+    """Fully transparent tile, served outside the raster's footprint."""
+    return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+def render_tile(path, layer, z, x, y):
+    """Reproject one 256×256 XYZ tile of a raster into Web Mercator and colour it as PNG."""
+    spec = TILE_LAYERS[layer]
+    west, south, east, north = tile_bounds(z, x, y)
+    with rasterio.open(path) as src:
+        left, bottom, right, top = transform_bounds(src.crs, "EPSG:3857", *src.bounds)
+        if left >= east or right <= west or bottom >= north or top <= south:
+            return empty_tile()
+        # Read from the coarsest internal overview that is still finer than a tile pixel
+        level = None
+        for i, factor in enumerate(src.overviews(1)):
+            if factor * (right - left) / src.width <= (east - west) / TILE_SIZE:
+                level = i
+    open_kwargs = {} if level is None else {"overview_level": level}
+    with rasterio.open(path, **open_kwargs) as src:
+        with WarpedVRT(
+            src, crs="EPSG:3857", resampling=spec["resampling"],
+            transform=transform_from_bounds(west, south, east, north, TILE_SIZE, TILE_SIZE),
+            width=TILE_SIZE, height=TILE_SIZE, nodata=np.nan, dtype="float32"
+        ) as vrt:
+            data = vrt.read(1)
+
+    valid = np.isfinite(data)
+    if spec["min_visible"] is not None:
+        valid &= data > spec["min_visible"]
+    if not valid.any():
+        return empty_tile()
+
+    data_min, data_max = raster_value_range(path, os.stat(path).st_mtime_ns)
+    vmin = data_min if spec["vmin"] is None else spec["vmin"]
+    vmax = data_max if spec["vmax"] is None else spec["vmax"]
+    scaled = (data[valid] - vmin) / ((vmax - vmin) or 1.0)
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    rgba[valid] = colormap_lut(spec["cmap"])[np.clip(scaled * 255, 0, 255).astype(np.uint8)]
+    return encode_png(rgba)
+
+def get_tile(job_dir, layer, z, x, y):
+    """PNG bytes of a tile from the in-memory tile cache, or None if the layer's raster is missing."""
+    path = os.path.join(job_dir, FILE_NAMES[TILE_LAYERS[layer]["key"]])
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cache_key = (path, mtime_ns, layer, z, x, y)
+    png = TILE_CACHE.get(cache_key)
+    if png is None:
+        png = render_tile(path, layer, z, x, y)
+        TILE_CACHE.set(cache_key, png)
+    return png
+
+def tile_urls(job_id, paths):
+    """XYZ URL templates for every tile layer whose raster exists in the workspace."""
+    return {
+        layer: f"/tiles/{job_id}/{layer}/{{z}}/{{x}}/{{y}}.png"
+        for layer, spec in TILE_LAYERS.items()
+        if os.path.exists(paths[spec["key"]])
+    }
+
+def prepare_site(address, paths=FILE_PATHS, progress=None, hydrology_backend=None, aoi=None):
+    """Run the scenario-independent stages (terrain, watershed, C-factor) for an address.
+
+    The area of interest is a box of aoi["radius_km"] around the geocoded
+    address, or the bounds of aoi["polygon"] (whose centroid then replaces the
+    address). Products are reused from the terrain cache when the same AOI was
+    processed before. progress, if given, is called as progress(stage, info)
+    after each stage. Returns None when no significant channel is found.
+    """
+    progress = progress or (lambda stage, info: None)
+    hydrology_backend = hydrology_backend or HYDROLOGY_BACKEND
+    aoi = aoi or {"radius_km": AOI_RADIUS_KM, "polygon": None}
+    polygon = aoi["polygon"]
+    with stage_timer("geocode"):
+        if polygon is not None:
+            from shapely.geometry import shape
+            geom = shape(polygon)
+            lat, lon = geom.centroid.y, geom.centroid.x
+        else:
+            lat, lon = geocode_location(address)
+    progress("geocode", {"latitude": float(round(lat, 6)), "longitude": float(round(lon, 6))})
+    bbox = geom.bounds if polygon is not None else get_bbox(lat, lon, aoi["radius_km"])
+
+    cache_key = terrain_cache_key(bbox, hydrology_backend, polygon)
+    with stage_timer("terrain_cache"):
+        terrain = load_terrain_products(cache_key, paths)
+    if terrain is None:
+        terrain = build_terrain_products(bbox, paths, progress, hydrology_backend, polygon)
+        store_terrain_products(cache_key, paths, terrain)
+    else:
+        progress("dem", {"bounding_box": bbox_metadata(bbox)})
+        if terrain["watershed_success"]:
+            progress("watershed", {"watershed_area_km2": float(round(terrain["watershed_area_m2"] / 1e6, 2))})
+            progress("landcover", {"mean_c_factor": float(round(terrain["mean_c_factor"], 2))})
+
+    if not terrain["watershed_success"]:
+        return None
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "bbox": bbox,
+        "watershed_area_m2": terrain["watershed_area_m2"],
+        "mean_c_factor": terrain["mean_c_factor"]
+    }
+
+def build_terrain_products(bbox, paths, progress, hydrology_backend, polygon=None):
+    """Download the DEM, delineate the watershed and compute its C-factor."""
+    with stage_timer("dem"):
+        dem_path = download_dem_opentopo(*bbox, paths)
+        if polygon is not None:
+            mask_to_polygon(dem_path, polygon)
+    progress("dem", {"bounding_box": bbox_metadata(bbox)})
+    with stage_timer("watershed"):
+        watershed_success, watershed_area_m2 = process_watershed(dem_path, paths, hydrology_backend)
+        # Publish the DEM (and its tile layer) as a COG once WhiteboxTools no longer reads it
+        convert_to_cog(dem_path, PREDICTOR="YES")
+    if not watershed_success:
+        return {"watershed_success": False}
+    progress("watershed", {"watershed_area_km2": float(round(watershed_area_m2 / 1e6, 2))})
+    with stage_timer("landcover"):
+        mean_c_factor = process_landcover(paths)
+    progress("landcover", {"mean_c_factor": float(round(mean_c_factor, 2))})
+    return {
+        "watershed_success": True,
+        "watershed_area_m2": watershed_area_m2,
+        "mean_c_factor": mean_c_factor
+    }
+
+def bbox_metadata(bbox):
+    """Rounded bounding box for responses."""
+    west, south, east, north = bbox
+    return {
+        "west": float(round(west, 6)),
+        "south": float(round(south, 6)),
+        "east": float(round(east, 6)),
+        "north": float(round(north, 6))
+    }
+
+def site_metadata(site):
+    """Response metadata shared by every scenario run on a site."""
+    return {
+        "latitude": float(round(site["latitude"], 6)),
+        "longitude": float(round(site["longitude"], 6)),
+        "bounding_box": bbox_metadata(site["bbox"]),
+        "mean_c_factor": float(round(site["mean_c_factor"], 2)),
+        "watershed_area_km2": float(round(site["watershed_area_m2"] / 1e6, 2))
+    }
+
+def basin_metadata(basin):
+    """Rounded per-basin results for responses."""
+    return {
+        "basin_id": basin["basin_id"],
+        "outlet_latitude": float(round(basin["outlet_latitude"], 6)),
+        "outlet_longitude": float(round(basin["outlet_longitude"], 6)),
+        "area_km2": float(round(basin["area_m2"] / 1e6, 2)),
+        "mean_c_factor": float(round(basin["mean_c_factor"], 2)),
+        "peak_runoff_cfs": float(round(basin["peak_runoff_cfs"], 2)),
+        "water_level_m": float(round(basin["water_level_m"], 2)),
+        "flooded_area_km2": float(round(basin["flooded_area_m2"] / 1e6, 2)),
+        "flooded_volume_m3": float(round(basin["flooded_volume_m3"], 2))
+    }
+
+def parse_number(data, key, default, cast=float):
+    """Finite number data[key] (default when absent) converted with cast; ValueError otherwise."""
+    value = data.get(key, default)
+    try:
+        if isinstance(value, bool):
+            raise TypeError(key)
+        number = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{key} must be a number")
+    if not math.isfinite(number):
+        raise ValueError(f"{key} must be finite")
+    return number
+
+def parse_process_params(data):
+    """Validate a /process or /jobs JSON body into pipeline parameters."""
+    return {
+        **parse_site(data),
+        **parse_storm(data),
+        "hydrology_backend": parse_hydrology_backend(data),
+        "basin_mode": parse_basin_mode(data),
+        **parse_routing(data),
+        **parse_flood_domain(data),
+        **parse_visualization(data)
+    }
+
+def parse_batch_params(data):
+    """Validate a /process/batch JSON body: one site and a list of storm scenarios."""
+    site = parse_site(data)
+    scenarios = data.get("scenarios")
+    if not isinstance(scenarios, list) or not scenarios or not all(isinstance(s, dict) for s in scenarios):
+        raise ValueError("A non-empty 'scenarios' list of objects is required")
+    if len(scenarios) > BATCH_MAX_SCENARIOS:
+        raise ValueError(f"At most {BATCH_MAX_SCENARIOS} scenarios are allowed per batch")
+    return {
+        **site,
+        "scenarios": [parse_storm(s) for s in scenarios],
+        "hydrology_backend": parse_hydrology_backend(data),
+        **parse_flood_domain(data)
+    }
+
+def parse_site(data):
+    """Address (or polygon) and area of interest in a JSON body."""
+    if not data:
+        raise ValueError("No JSON data provided")
+    if not isinstance(data, dict):
+        raise ValueError("The JSON body must be an object")
+    address = data.get("address")
+    if not address and data.get("polygon") is None:
+        raise ValueError("Address is required")
+    if address and not isinstance(address, str):
+        raise ValueError("address must be a string")
+    return {"address": address, **parse_aoi(data)}
+
+def parse_storm(data):
+    """Rainfall intensity (inches/hour) and duration (hours) in a JSON body or batch scenario."""
+    rainfall_intensity = parse_number(data, "rainfall_intensity", DEFAULT_RAINFALL_INTENSITY)
+    duration = parse_number(data, "duration", DEFAULT_DURATION)
+    if duration <= 0 or rainfall_intensity < 0:
+        raise ValueError("duration must be positive and rainfall_intensity not negative")
+    return {"rainfall_intensity": rainfall_intensity, "duration": duration}
+
+def parse_visualization(data):
+    """3D visualization mode, triangle budget and export formats requested in a JSON body."""
+    viz_mode = data.get("viz_mode", VIZ_MODE)
+    if viz_mode not in VIZ_MODES:
+        raise ValueError(f"viz_mode must be one of {', '.join(VIZ_MODES)}")
+    viz_target_triangles = parse_number(data, "viz_target_triangles", VIZ_TARGET_TRIANGLES, int)
+    if viz_target_triangles < 1000:
+        raise ValueError("viz_target_triangles must be at least 1000")
+    viz_formats = data.get("viz_formats", VIZ_DEFAULT_FORMATS)
+    if not isinstance(viz_formats, list) or not all(f in VIZ_FORMATS for f in viz_formats):
+        raise ValueError(f"viz_formats must be a list drawn from {', '.join(VIZ_FORMATS)}")
+    return {
+        "viz_mode": viz_mode,
+        "viz_target_triangles": viz_target_triangles,
+        "viz_formats": sorted(set(viz_formats))
+    }
+
+def parse_flood_domain(data):
+    """Flood extent ("bbox" or "watershed") and watershed buffer requested in a JSON body."""
+    flood_extent = data.get("flood_extent", FLOOD_EXTENT)
+    if flood_extent not in FLOOD_EXTENTS:
+        raise ValueError(f"flood_extent must be one of {', '.join(FLOOD_EXTENTS)}")
+    flood_buffer_cells = parse_number(data, "flood_buffer_cells", 0, int)
+    if flood_buffer_cells < 0:
+        raise ValueError("flood_buffer_cells must not be negative")
+    return {"flood_extent": flood_extent, "flood_buffer_cells": flood_buffer_cells}
+
+def parse_routing(data):
+    """Flood routing mode and storm description requested in a JSON body.
+
+    "hydrograph" routing takes an optional "hyetograph" (intensities in inches/hour,
+    each lasting "hyetograph_step_min"); without one the storm is rainfall_intensity
+    held for duration hours.
+    """
+    routing = data.get("routing", ROUTING_MODE)
+    if routing not in ROUTING_MODES:
+        raise ValueError(f"routing must be one of {', '.join(ROUTING_MODES)}")
+    if routing == "static":
+        return {"routing": routing}
+    if data.get("basin_mode", BASIN_MODE) == "multi":
+        raise ValueError("hydrograph routing models the main watershed only; use basin_mode 'single'")
+    time_step_min = parse_number(data, "time_step_min", ROUTING_TIME_STEP_MIN)
+    recession_h = parse_number(data, "recession_h", ROUTING_RECESSION_H)
+    if time_step_min <= 0 or recession_h < 0:
+        raise ValueError("time_step_min must be positive and recession_h not negative")
+    hyetograph = data.get("hyetograph")
+    if hyetograph is not None:
+        if not isinstance(hyetograph, list) or not hyetograph or \
+                not all(isinstance(i, (int, float)) and not isinstance(i, bool) and math.isfinite(i) and i >= 0
+                        for i in hyetograph):
+            raise ValueError("hyetograph must be a non-empty list of rainfall intensities (inches/hour)")
+        hyetograph_step_min = parse_number(data, "hyetograph_step_min", time_step_min)
+        if hyetograph_step_min <= 0:
+            raise ValueError("hyetograph_step_min must be positive")
+        storm_min = len(hyetograph) * hyetograph_step_min
+    else:
+        hyetograph_step_min = None
+        storm_min = parse_number(data, "duration", DEFAULT_DURATION) * 60
+    n_steps = math.ceil((storm_min + recession_h * 60) / time_step_min)
+    if n_steps > ROUTING_MAX_STEPS:
+        raise ValueError(f"Routing would take {n_steps} time steps; the limit is {ROUTING_MAX_STEPS}")
+    return {
+        "routing": routing,
+        "hyetograph": hyetograph,
+        "hyetograph_step_min": hyetograph_step_min,
+        "time_step_min": time_step_min,
+        "recession_h": recession_h,
+        "routing_steps": n_steps
+    }
+
+def parse_basin_mode(data):
+    """Basin mode requested in a JSON body, defaulting to BASIN_MODE."""
+    basin_mode = data.get("basin_mode", BASIN_MODE)
+    if basin_mode not in BASIN_MODES:
+        raise ValueError(f"basin_mode must be one of {', '.join(BASIN_MODES)}")
+    return basin_mode
+
+def parse_aoi(data):
+    """Area of interest in a JSON body: radius_km around the address, or a GeoJSON polygon."""
+    radius_km = parse_number(data, "radius_km", AOI_RADIUS_KM)
+    if radius_km <= 0:
+        raise ValueError("radius_km must be positive")
+    polygon = data.get("polygon")
+    if polygon is not None:
+        from shapely.geometry import shape
+        try:
+            geom = shape(polygon)
+        except Exception:
+            raise ValueError("polygon must be a GeoJSON Polygon or MultiPolygon geometry")
+        if geom.geom_type not in ("Polygon", "MultiPolygon") or geom.is_empty or not geom.is_valid:
+            raise ValueError("polygon must be a valid GeoJSON Polygon or MultiPolygon geometry")
+        area_km2 = bbox_area_km2(geom.bounds)
+    else:
+        area_km2 = (2 * radius_km) ** 2
+    if area_km2 > MAX_AOI_KM2:
+        raise ValueError(f"Area of interest ({area_km2:.0f} km²) exceeds the {MAX_AOI_KM2:g} km² limit")
+    return {"radius_km": radius_km, "polygon": polygon}
+
+def parse_hydrology_backend(data):
+    """Hydrology backend requested in a JSON body, defaulting to HYDROLOGY_BACKEND."""
+    hydrology_backend = data.get("hydrology_backend", HYDROLOGY_BACKEND)
+    if hydrology_backend not in HYDROLOGY_BACKENDS:
+        raise ValueError(f"hydrology_backend must be one of {', '.join(HYDROLOGY_BACKENDS)}")
+    return hydrology_backend
+
+def run_pipeline(job_id, paths, params, progress=None):
+    """Run every stage for one request and return the response payload.
+
+    Stages are timed by the caller's active StageProfiler, if any.
+    Returns None when no significant channel is found.
+    """
+    progress = progress or (lambda stage, info: None)
+    flood_h = params["duration"]
+    rainfall_intensity = params["rainfall_intensity"]
+
+    site = prepare_site(
+        params["address"], paths, progress, params["hydrology_backend"],
+        {"radius_km": params["radius_km"], "polygon": params["polygon"]}
+    )
+    if site is None:
+        return None
+
+    with stage_timer("runoff"):
+        Q_feet3_s = calculate_peak_runoff(site["watershed_area_m2"], rainfall_intensity, site["mean_c_factor"])
+    progress("runoff", {"peak_runoff_cfs": float(round(Q_feet3_s, 2))})
+
+    basins = None
+    if params["basin_mode"] == "multi":
+        with stage_timer("basins"):
+            basins = delineate_basins(paths)
+            for basin, mean_c_factor in zip(basins, basin_c_factors(paths, len(basins))):
+                basin["mean_c_factor"] = float(mean_c_factor)
+                basin["peak_runoff_cfs"] = calculate_peak_runoff(basin["area_m2"], rainfall_intensity, mean_c_factor)
+        with stage_timer("flood"):
+            flooded_area_km2, flooded_volume_m3 = calculate_basin_flood_depth(basins, flood_h, paths)
+    elif params["routing"] == "hydrograph":
+        with stage_timer("flood"):
+            if params["hyetograph"] is not None:
+                hyetograph, hyetograph_step_min = params["hyetograph"], params["hyetograph_step_min"]
+            else:
+                hyetograph, hyetograph_step_min = [rainfall_intensity], flood_h * 60
+            rainfall_m = storm_rainfall(
+                hyetograph, hyetograph_step_min, params["time_step_min"], params["routing_steps"]
+            )
+            routed = route_hydrograph(rainfall_m, params["time_step_min"], site["mean_c_factor"], paths)
+            flooded_area_km2, flooded_volume_m3 = routed["flooded_area_km2"], routed["flooded_volume_m3"]
+    else:
+        with stage_timer("flood"):
+            flooded_area_km2, flooded_volume_m3 = calculate_flood_depth(
+                Q_feet3_s, flood_h, paths, params["flood_extent"], params["flood_buffer_cells"]
+            )
+    progress("flood", {
+        "flooded_area_km2": float(round(flooded_area_km2, 2)),
+        "flooded_volume_m3": float(round(flooded_volume_m3, 2)),
+        **({"basin_count": len(basins)} if basins is not None else {}),
+        **({"peak_outflow_cms": routed["hydrograph"]["peak_outflow_cms"]} if params["routing"] == "hydrograph" else {})
+    })
+    viz_keys = []
+    if params["viz_formats"]:  # PyVista is only loaded when 3D output is requested
+        with stage_timer("visualization"):
+            viz_keys = render_visualization(
+                paths, params["viz_mode"], params["viz_target_triangles"], params["viz_formats"]
+            )
+    progress("visualization", {})
+
+    metadata = {
+        "flooded_area_km2": float(round(flooded_area_km2, 2)),
+        "flooded_volume_m3": float(round(flooded_volume_m3, 2)),
+        **site_metadata(site),
+        "peak_runoff_cfs": float(round(Q_feet3_s, 2)),
+        "rainfall_intensity": float(rainfall_intensity)
+    }
+    if basins is not None:
+        metadata["basins"] = [basin_metadata(basin) for basin in basins]
+    if params["routing"] == "hydrograph":
+        metadata["hydrograph"] = routed["hydrograph"]
+
+    return {
+        "status": "success",
+        "job_id": job_id,
+        "files": [
+            download_url(job_id, paths, "flood_depth"),
+            download_url(job_id, paths, "flood_depth_png"),
+            download_url(job_id, paths, "landcover_c_factor_png"),
+            download_url(job_id, paths, "streams"),
+            *([download_url(job_id, paths, "basins_tif")] if basins is not None else []),
+            *([download_url(job_id, paths, "flood_depth_series")] if params["routing"] == "hydrograph" else []),
+            *(download_url(job_id, paths, key) for key in viz_keys)
+        ],
+        "tiles": tile_urls(job_id, paths),
+        "metadata": metadata,
+        "profile": profile_summary()
+    }
+
+def stage_downloads(job_id, paths, stage):
+    """Download URLs of the products a completed stage has written (PNGs count once their source exists)."""
+    urls = []
+    for key in STAGE_PRODUCTS.get(stage, []):
+        source_key = PNG_RENDERERS[key][0] if key in PNG_RENDERERS else key
+        if os.path.exists(paths[source_key]):
+            urls.append(download_url(job_id, paths, key))
+    return urls
+
+def sse_event(event, data):
+    """One Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def profile_summary():
+    """Stage breakdown recorded so far by the active profiler."""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        return {}
+    return {
+        "total_wall_s": round(sum(r["wall_s"] for name, r in profiler.stages.items() if "." not in name), 4),
+        "stages": {name: dict(record) for name, record in profiler.stages.items()}
+    }
+
+def write_job_status(paths, status):
+    """Atomically persist a job's status document into its workspace."""
+    status = dict(status, updated_at=time.time())
+    tmp_path = paths["job_status"] + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, paths["job_status"])
+
+def read_job_status(job_id):
+    """Load a job's status document, or None if the job is unknown."""
+    job_dir = get_workspace_dir(job_id)
+    if job_dir is None:
+        return None
+    status_path = build_file_paths(job_dir)["job_status"]
+    if not os.path.exists(status_path):
+        return None
+    with open(status_path) as f:
+        return json.load(f)
+
+def _run_job(job_id, params):
+    """Worker-process entry point: run the pipeline and record stage progress."""
+    paths = build_file_paths(os.path.join(JOBS_DIR, job_id))
+    status = read_job_status(job_id)
+    status.update(state="running", started_at=time.time())
+    write_job_status(paths, status)
+
+    def progress(stage, info):
+        status["stages_completed"].append(stage)
+        status["stage"] = stage
+        status["progress"] = round(len(status["stages_completed"]) / len(PIPELINE_STAGES), 2)
+        status["metadata"].update(info)
+        write_job_status(paths, status)
+
+    profiler = StageProfiler()
+    try:
+        with profiler.activate():
+            result = run_pipeline(job_id, paths, params, progress)
+        if result is None:
+            status.update(state="failed", error=NO_CHANNEL_MESSAGE)
+        else:
+            status.update(state="succeeded", progress=1.0, result=result)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        status.update(state="failed", error=str(e))
+    status["profile"] = profiler.stages
+    status["finished_at"] = time.time()
+    write_job_status(paths, status)
+    return status["state"]
+
+_job_executor = None
+_active_jobs = set()
+_jobs_lock = threading.Lock()
+
+def _get_job_executor():
+    """Lazily create the bounded worker pool shared by all job submissions."""
+    global _job_executor
+    if _job_executor is None:
+        _job_executor = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS,
+            mp_context=multiprocessing.get_context(JOB_START_METHOD),
+            initializer=warm_up,
+            initargs=(True,)  # job workers render their 3D output inline
+        )
+    return _job_executor
+
+def _discard_job_executor(executor):
+    """Drop a broken worker pool so the next submission starts a fresh one."""
+    global _job_executor
+    if _job_executor is executor:
+        _job_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def submit_job(params):
+    """Queue a pipeline run; returns the job id, or None when the queue is full.
+
+    Raises BrokenProcessPool when a worker died; the pool is then recreated on
+    the next submission and the job is recorded as failed.
+    """
+    cleanup_workspaces()
+    with _jobs_lock:
+        if len(_active_jobs) >= JOB_WORKERS + JOB_QUEUE_SIZE:
+            return None
+        job_id, paths = create_workspace(cleanup=False)
+        status = {
+            "job_id": job_id,
+            "state": "queued",
+            "stage": None,
+            "stages_completed": [],
+            "progress": 0.0,
+            "params": params,
+            "metadata": {},
+            "submitted_at": time.time()
+        }
+        write_job_status(paths, status)
+        executor = _get_job_executor()
+        try:
+            future = executor.submit(_run_job, job_id, params)
+        except BrokenProcessPool as e:
+            _discard_job_executor(executor)
+            status.update(state="failed", error=f"Job worker pool was restarted: {str(e)}")
+            write_job_status(paths, status)
+            release_workspace(job_id)
+            raise
+        _active_jobs.add(job_id)
+
+    def on_done(fut):
+        with _jobs_lock:
+            _active_jobs.discard(job_id)
+            if isinstance(fut.exception(), BrokenProcessPool):
+                _discard_job_executor(executor)
+        release_workspace(job_id)
+        if fut.exception() is None:
+            # Workers run in other processes, so results and metrics are recorded here in the parent
+            status = read_job_status(job_id) or {}
+            observe_stage_metrics(status.get("profile", {}))
+            if status.get("state") == "succeeded":
+                RESPONSE_CACHE.set(response_cache_key(params), status["result"])
+        else:
+            # The worker died before it could record the failure itself
+            logger.error(f"Job {job_id} crashed: {fut.exception()}")
+            status = read_job_status(job_id) or {"job_id": job_id}
+            status.update(state="failed", error=str(fut.exception()))
+            write_job_status(paths, status)
+
+    future.add_done_callback(on_done)
+    logger.info(f"Queued job {job_id} ({len(_active_jobs)} active)")
+    return job_id
 
 @app.route('/process', methods=["POST"])
 def process():
     """Main processing endpoint."""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"status": "error", "message": "No JSON data provided"}), 400
+        try:
+            params = parse_process_params(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        cached = get_cached_response(params)
+        if cached is not None:
+            logger.info(f"Response cache hit: job {cached['job_id']}")
+            return jsonify(dict(cached, cache_hit=True))
+
+        job_id, paths = create_workspace()
+        profiler = StageProfiler()
+        try:
+            with profiler.activate():
+                response = run_pipeline(job_id, paths, params)
+        finally:
+            observe_stage_metrics(profiler.stages)
+            release_workspace(job_id)
+        if response is None:
+            return jsonify({"status": "error", "message": NO_CHANNEL_MESSAGE}), 400
+
+        RESPONSE_CACHE.set(response_cache_key(params), response)
+        return jsonify(response)
 
-        address = data.get("address")
-        flood_h = float(data.get("duration", 150))
-        rainfall_intensity = float(data.get("rainfall_intensity", DEFAULT_RAINFALL_INTENSITY))
+    except Exception as e:
+        logger.error(f"Processing error: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        if not address:
-            return jsonify({"status": "error", "message": "Address is required"}), 400
+@app.route('/process/stream', methods=["POST"])
+def process_stream():
+    """Run the pipeline like /process, streaming each stage's results as Server-Sent Events.
 
-        lat, lon = geocode_location(address)
-        west, south, east, north = get_bbox(lat, lon)
-        dem_path = download_dem_opentopo(west, south, east, north)
-        watershed_success, watershed_area_m2 = process_watershed(dem_path)
+    Events: "job" (the job id), one "stage" per completed stage with its metadata,
+    downloads and tile layers, then "result" (the full /process response) or "error".
+    The pipeline runs in a background thread and finishes even if the client disconnects.
+    """
+    try:
+        params = parse_process_params(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    events = queue.Queue()
+    cached = get_cached_response(params)
+    if cached is not None:
+        logger.info(f"Response cache hit: job {cached['job_id']}")
+        events.put(("job", {"job_id": cached["job_id"]}))
+        events.put(("result", dict(cached, cache_hit=True)))
+        events.put(None)
+    else:
+        job_id, paths = create_workspace()
+        events.put(("job", {"job_id": job_id}))
+        completed = []
+
+        def progress(stage, info):
+            completed.append(stage)
+            events.put(("stage", {
+                "stage": stage,
+                "progress": round(len(completed) / len(PIPELINE_STAGES), 2),
+                "metadata": info,
+                "files": stage_downloads(job_id, paths, stage),
+                "tiles": tile_urls(job_id, paths)
+            }))
+
+        def run():
+            profiler = StageProfiler()
+            try:
+                with profiler.activate():
+                    response = run_pipeline(job_id, paths, params, progress)
+                if response is None:
+                    events.put(("error", {"status": "error", "message": NO_CHANNEL_MESSAGE}))
+                else:
+                    RESPONSE_CACHE.set(response_cache_key(params), response)
+                    events.put(("result", response))
+            except Exception as e:
+                logger.error(f"Processing error: {str(e)}")
+                events.put(("error", {"status": "error", "message": str(e)}))
+            finally:
+                observe_stage_metrics(profiler.stages)
+                release_workspace(job_id)
+                events.put(None)
+
+        threading.Thread(target=run, name=f"stream-{job_id}", daemon=True).start()
+
+    def generate():
+        while True:
+            try:
+                item = events.get(timeout=SSE_KEEPALIVE_S)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield sse_event(*item)
+
+    return Response(
+        stream_with_context(generate()), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # no proxy buffering
+    )
 
-        if not watershed_success:
-            return jsonify({
-                "status": "error",
-                "message": "No significant channels detected in the watershed"
-            }), 400
+@app.route('/jobs', methods=["POST"])
+def create_job():
+    """Submit a pipeline run to the worker pool and return its job id immediately."""
+    try:
+        params = parse_process_params(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    cached = get_cached_response(params)
+    if cached is not None:
+        logger.info(f"Response cache hit: job {cached['job_id']}")
+        # Record the cached result as a finished job, so its status_url resolves like any other
+        job_id, paths = create_workspace()
+        now = time.time()
+        status = {
+            "job_id": job_id,
+            "state": "succeeded",
+            "stage": PIPELINE_STAGES[-1],
+            "stages_completed": list(PIPELINE_STAGES),
+            "progress": 1.0,
+            "params": params,
+            "metadata": {},
+            "submitted_at": now,
+            "started_at": now,
+            "finished_at": now,
+            "result": dict(cached, cache_hit=True),
+            "profile": {}
+        }
+        write_job_status(paths, status)
+        release_workspace(job_id)
+        return jsonify({"status": "succeeded", "job_id": job_id, "status_url": f"/jobs/{job_id}",
+                        "result": status["result"]})
 
-        mean_c_factor = process_landcover()
-        Q_feet3_s = calculate_peak_runoff(watershed_area_m2, rainfall_intensity, mean_c_factor)
-        flooded_area_km2, flooded_volume_m3 = calculate_flood_depth(Q_feet3_s, flood_h)
-        create_3d_visualization()
+    try:
+        job_id = submit_job(params)
+    except BrokenProcessPool as e:
+        logger.error(f"Job worker pool crashed: {str(e)}")
+        response = jsonify({"status": "error", "message": "Job workers are restarting, retry later"})
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER_S)
+        return response, 503
+    if job_id is None:
+        response = jsonify({"status": "error", "message": "Job queue is full, retry later"})
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER_S)
+        return response, 503
+    return jsonify({"status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/jobs/<job_id>', methods=["GET"])
+def get_job(job_id):
+    """Report stage-level progress and, once finished, the job's result."""
+    status = read_job_status(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    return jsonify(status)
+
+@app.route('/process/batch', methods=["POST"])
+def process_batch():
+    """Evaluate many rainfall/duration scenarios against one watershed."""
+    try:
+        try:
+            params = parse_batch_params(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        scenarios = params["scenarios"]
+
+        job_id, paths = create_workspace()
+        profiler = StageProfiler()
+        try:
+            with profiler.activate():
+                site = prepare_site(
+                    params["address"], paths, hydrology_backend=params["hydrology_backend"],
+                    aoi={"radius_km": params["radius_km"], "polygon": params["polygon"]}
+                )
+                if site is None:
+                    return jsonify({"status": "error", "message": NO_CHANNEL_MESSAGE}), 400
+
+                with stage_timer("runoff"):
+                    for scenario in scenarios:
+                        scenario["peak_runoff_cfs"] = calculate_peak_runoff(
+                            site["watershed_area_m2"], scenario["rainfall_intensity"], site["mean_c_factor"]
+                        )
+                with stage_timer("flood"):
+                    results = calculate_flood_depth_batch(
+                        scenarios, paths, params["flood_extent"], params["flood_buffer_cells"]
+                    )
+                profile = profile_summary()
+        finally:
+            observe_stage_metrics(profiler.stages)
+            release_workspace(job_id)
 
         response = {
             "status": "success",
+            "job_id": job_id,
             "files": [
-                f"/download/{os.path.basename(FILE_PATHS['flood_depth'])}",
-                f"/download/{os.path.basename(FILE_PATHS['flood_depth_png'])}",
-                f"/download/{os.path.basename(FILE_PATHS['landcover_c_factor_png'])}",
-                f"/download/{os.path.basename(FILE_PATHS['streams'])}",
-                f"/download/{os.path.basename(FILE_PATHS['flood_visualization'])}"
+                download_url(job_id, paths, "flood_depth_batch"),
+                download_url(job_id, paths, "landcover_c_factor_png"),
+                download_url(job_id, paths, "streams")
             ],
-            "metadata": {
-                "flooded_area_km2": float(round(flooded_area_km2, 2)),
-                "flooded_volume_m3": float(round(flooded_volume_m3, 2)),
-                "latitude": float(round(lat, 6)),
-                "longitude": float(round(lon, 6)),
-                "bounding_box": {
-                    "west": float(round(west, 6)),
-                    "south": float(round(south, 6)),
-                    "east": float(round(east, 6)),
-                    "north": float(round(north, 6))
-                },
-                "peak_runoff_cfs": float(round(Q_feet3_s, 2)),
-                "mean_c_factor": float(round(mean_c_factor, 2)),
-                "rainfall_intensity": float(rainfall_intensity),
-                "watershed_area_km2": float(round(watershed_area_m2 / 1e6, 2))
-            }
+            "tiles": tile_urls(job_id, paths),
+            "metadata": site_metadata(site),
+            "scenarios": [
+                {
+                    "rainfall_intensity": scenario["rainfall_intensity"],
+                    "duration": scenario["duration"],
+                    "peak_runoff_cfs": float(round(scenario["peak_runoff_cfs"], 2)),
+                    **result
+                }
+                for scenario, result in zip(scenarios, results)
+            ],
+            "profile": profile
         }
 
         return jsonify(response)
 
     except Exception as e:
-        logger.error(f"Processing error: {str(e)}")
+        logger.error(f"Batch processing error: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route("/download/<path:filename>", methods=["GET"])
-def download(filename):
-    """Serve files from the output directory."""
-    safe_path = os.path.join(OUTPUT_DIR, filename)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-style stage latency histograms, I/O, memory and cache counters."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """Hit/miss counters and sizes of the result caches."""
+    return jsonify(cache_stats())
+
+@app.route("/tiles/<job_id>/<layer>/<int:z>/<int:x>/<int:y>.png", methods=["GET"])
+def get_map_tile(job_id, layer, z, x, y):
+    """Serve an XYZ map tile of a job's flood depth, C-factor or DEM raster."""
+    job_dir = get_workspace_dir(job_id)
+    if job_dir is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    if layer not in TILE_LAYERS:
+        return jsonify({"status": "error", "message": f"Unknown tile layer '{layer}'"}), 404
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"status": "error", "message": f"Tile {z}/{x}/{y} is out of range"}), 400
+    try:
+        png = get_tile(job_dir, layer, z, x, y)
+    except Exception as e:
+        logger.error(f"Tile rendering error: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if png is None:
+        return jsonify({"status": "error", "message": f"Layer '{layer}' not available for job {job_id}"}), 404
+    return Response(png, mimetype="image/png", headers={"Cache-Control": f"max-age={int(TILE_CACHE_TTL_S)}"})
+
+@app.route("/download/<job_id>/<path:filename>", methods=["GET"])
+def download(job_id, filename):
+    """Serve files from a job's workspace."""
+    job_dir = get_workspace_dir(job_id)
+    if job_dir is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    safe_path = os.path.join(job_dir, filename)
     if not os.path.exists(safe_path):
-        return jsonify({"status": "error", "message": f"File {filename} not found"}), 404
+        png_key = next((key for key in PNG_RENDERERS if FILE_NAMES[key] == filename), None)
+        if png_key is None or not render_png(build_file_paths(job_dir), png_key):
+            return jsonify({"status": "error", "message": f"File {filename} not found"}), 404
     return send_from_directory(
-        OUTPUT_DIR, filename,
-        as_attachment=not filename.endswith(".html")
+        job_dir, filename,
+        as_attachment=not filename.endswith(".html"),
+        conditional=True  # ETag/If-Modified-Since and byte-range requests for GIS clients
     )
 
 if __name__ == "__main__":
-    logger.info("Starting Flask application")
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Flood-Factor API server")
+    subparsers = parser.add_subparsers(dest="command")
+    seed_parser = subparsers.add_parser("seed-dem", help="Pre-download DEM tiles for a region")
+    seed_group = seed_parser.add_mutually_exclusive_group(required=True)
+    seed_group.add_argument("--region", choices=sorted(SEED_REGIONS), help="Named region to seed")
+    seed_group.add_argument("--bounds", nargs=4, type=float, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    args = parser.parse_args()
+
+    if args.command == "seed-dem":
+        seed_dem_cache(*(SEED_REGIONS[args.region] if args.region else args.bounds))
+    else:
+        logger.info("Starting Flask application")
+        warm_up()
+        app.run(debug=True)
\ No newline at end of file